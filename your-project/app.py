@@ -1,13 +1,23 @@
-from flask import Flask, request, send_file, render_template_string, redirect, url_for, flash, session
+from flask import Flask, request, send_file, render_template_string, redirect, url_for, flash, session, Response, g
 import fitz  # PyMuPDF
-from PIL import Image, ImageDraw, ImageFont
-import os, uuid, random, re, shutil, json, hashlib, sqlite3, time
+from PIL import Image, ImageDraw, ImageFont, ImageChops, ImageColor
+try:
+    import pyvips  # optional, only for IMAGE_BACKEND=vips
+except (ImportError, OSError):
+    pyvips = None
+import os, sys, uuid, random, re, shutil, json, hashlib, sqlite3, time, math
+import threading, queue, atexit, argparse, tempfile, struct, zlib, fcntl, weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from collections import Counter, deque
+import resource, tracemalloc, cProfile, pstats
+from contextlib import contextmanager
 import pytesseract
 from datetime import datetime, timedelta
 from ethiopian_date import EthiopianDateConverter
-from functools import wraps
+from functools import wraps, lru_cache
 import qrcode
-from io import BytesIO
+from io import BytesIO, StringIO
+import csv
 import base64
 
 app = Flask(__name__)
@@ -17,14 +27,15 @@ app.secret_key = os.environ.get('SECRET_KEY', 'free_service_secret_key_2024')
 UPLOAD_FOLDER = "uploads"
 IMG_FOLDER = "extracted_images"
 CARD_FOLDER = "cards"
-DB_PATH = os.path.join(os.getcwd(), "database.db")
+RENDER_FOLDER = "renders"
+DB_PATH = os.environ.get('DB_PATH', os.path.join(os.getcwd(), "database.db"))
 FONT_PATH = "fonts/AbyssinicaSIL-Regular.ttf"
 TEMPLATE_PATH = "static/id_card_template.png"
 
 # FREE SERVICE - NO PAYMENT REQUIRED
 FREE_MODE = True  # Hardcoded FREE mode
 
-for folder in [UPLOAD_FOLDER, IMG_FOLDER, CARD_FOLDER]:
+for folder in [UPLOAD_FOLDER, IMG_FOLDER, CARD_FOLDER, RENDER_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 # Tesseract setup for Render
@@ -38,6 +49,10 @@ def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
+    # Only takes effect on a fresh database; existing ones are converted
+    # by run_retention() so freed pages can be reclaimed incrementally
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
     # Users table
     c.execute('''CREATE TABLE IF NOT EXISTS users
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -74,10 +89,50 @@ def init_db():
                   used INTEGER DEFAULT 0,
                   FOREIGN KEY (user_id) REFERENCES users (id))''')
     
+    # Indexes used by the retention batches
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_generated_created_at ON cards_generated (created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_free_transactions_created_at ON free_transactions (created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_free_transactions_user_created ON free_transactions (user_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_password_resets_expires_at ON password_resets (expires_at)")
+    
+    # Retention progress, e.g. the day free_transactions are compacted up to
+    c.execute('''CREATE TABLE IF NOT EXISTS retention_state
+                 (name TEXT PRIMARY KEY,
+                  value TEXT NOT NULL)''')
+    
+    # Card history pages (keyset pagination on created_at, id per user)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_generated_user_created ON cards_generated (user_id, created_at, id)")
+    
+    # Usage rollups, maintained by the accounting writer (see update_usage_rollups)
+    c.execute('''CREATE TABLE IF NOT EXISTS usage_daily
+                 (day TEXT PRIMARY KEY,
+                  cards INTEGER NOT NULL DEFAULT 0)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS usage_hourly
+                 (hour TEXT PRIMARY KEY,
+                  cards INTEGER NOT NULL DEFAULT 0)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS usage_user_daily
+                 (user_id INTEGER NOT NULL,
+                  day TEXT NOT NULL,
+                  cards INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (user_id, day))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_daily_day ON usage_user_daily (day)")
+    
     conn.commit()
     conn.close()
 
-init_db()
+# Created on the first request rather than at import, so the render CLI and
+# scripts that import app never create or migrate database.db
+_db_ready = False
+_db_ready_lock = threading.Lock()
+
+@app.before_request
+def init_db_once():
+    global _db_ready
+    if not _db_ready:
+        with _db_ready_lock:
+            if not _db_ready:
+                init_db()
+                _db_ready = True
 
 # 3. FREE PRICING - ALL ZERO
 PRICING = {
@@ -104,22 +159,773 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Comma separated usernames allowed into the /admin pages
+ADMIN_USERNAMES = {u.strip() for u in os.environ.get('ADMIN_USERNAMES', '').split(',') if u.strip()}
+
+def is_admin():
+    return session.get('username') in ADMIN_USERNAMES
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return redirect(url_for('login'))
+        if not is_admin():
+            flash('Admin access required!', 'error')
+            return redirect(url_for('dashboard'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+FILE_MAX_AGE = 3600  # seconds uploads, photos, cards and render records are kept
+
 def clear_old_files():
     """Foldaroota qulqulleessuu"""
-    for folder in [UPLOAD_FOLDER, IMG_FOLDER, CARD_FOLDER]:
+    for folder in [UPLOAD_FOLDER, IMG_FOLDER, CARD_FOLDER, RENDER_FOLDER]:
         for filename in os.listdir(folder):
             file_path = os.path.join(folder, filename)
             try:
                 if os.path.isfile(file_path):
                     # Delete files older than 1 hour
-                    if os.path.getmtime(file_path) < time.time() - 3600:
+                    if os.path.getmtime(file_path) < time.time() - FILE_MAX_AGE:
                         os.remove(file_path)
             except Exception as e:
                 print(f"Error deleting {file_path}: {e}")
 
+# Accounting writer - card records are queued and written in batches
+# by a background thread so SQLite lock waits stay off the response path.
+ACCOUNTING_BATCH_SIZE = int(os.environ.get('ACCOUNTING_BATCH_SIZE', 50))
+ACCOUNTING_FLUSH_INTERVAL = float(os.environ.get('ACCOUNTING_FLUSH_INTERVAL', 0.5))
+ACCOUNTING_RETRIES = 3
+# Batches the database would not take are appended here and replayed by the writer
+ACCOUNTING_SPOOL_PATH = os.path.join(os.getcwd(), "accounting_spool.jsonl")
+
+accounting_queue = queue.Queue()
+_accounting_lock = threading.Lock()
+_accounting_thread = None
+_accounting_pid = None
+
+def record_card_generation(user_id, card_path):
+    """Queue the accounting writes for one generated card"""
+    _ensure_accounting_writer()
+    created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    accounting_queue.put((user_id, card_path, created_at))
+
+def write_accounting_batch(batch):
+    """Write a batch of (user_id, card_path, created_at) in one transaction"""
+    per_user = Counter(item[0] for item in batch)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        with conn:
+            conn.executemany("INSERT INTO cards_generated (user_id, card_path, created_at) VALUES (?, ?, ?)",
+                             batch)
+            conn.executemany("INSERT INTO free_transactions (user_id, created_at) VALUES (?, ?)",
+                             [(user_id, created_at) for user_id, _, created_at in batch])
+            conn.executemany("UPDATE users SET free_cards_generated = free_cards_generated + ? WHERE id = ?",
+                             [(count, user_id) for user_id, count in per_user.items()])
+            update_usage_rollups(conn, [(user_id, created_at) for user_id, _, created_at in batch])
+    finally:
+        conn.close()
+
+def spill_accounting_batch(batch):
+    """Append records the database would not take to the spool file"""
+    with open(ACCOUNTING_SPOOL_PATH, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write("".join(json.dumps(item) + "\n" for item in batch))
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"Spilled {len(batch)} accounting records to {ACCOUNTING_SPOOL_PATH}")
+
+def replay_accounting_spool():
+    """Write spilled records to the database; they stay spooled if that fails again"""
+    try:
+        if os.path.getsize(ACCOUNTING_SPOOL_PATH) == 0:
+            return 0
+        f = open(ACCOUNTING_SPOOL_PATH, "r+")
+    except FileNotFoundError:
+        return 0
+    with f:
+        # Held while writing, so two workers never replay the same records
+        fcntl.flock(f, fcntl.LOCK_EX)
+        batch = []
+        for line in f:
+            try:
+                batch.append(tuple(json.loads(line)))
+            except ValueError:
+                pass  # a line cut short by a crash mid-append
+        if batch:
+            write_accounting_batch(batch)
+        f.truncate(0)
+    print(f"Replayed {len(batch)} spilled accounting records")
+    return len(batch)
+
+def _flush_accounting_batch(batch):
+    """Write a batch, retrying lock timeouts; spill it to disk if the database keeps failing"""
+    written = False
+    for attempt in range(ACCOUNTING_RETRIES):
+        try:
+            write_accounting_batch(batch)
+            written = True
+            break
+        except sqlite3.OperationalError as e:
+            print(f"Accounting write failed (attempt {attempt + 1}): {e}")
+            time.sleep(0.2 * (attempt + 1))
+        except Exception as e:
+            print(f"Accounting write failed: {e}")
+            break
+    if not written:
+        spill_accounting_batch(batch)
+        return
+    try:
+        replay_accounting_spool()
+    except Exception as e:
+        print(f"Replaying spilled accounting records failed: {e}")
+
+def accounting_writer():
+    """Background loop: collect queued records and flush them in batches"""
+    try:
+        replay_accounting_spool()  # spilled before the last restart
+    except Exception as e:
+        print(f"Replaying spilled accounting records failed: {e}")
+    stopping = False
+    while not stopping:
+        item = accounting_queue.get()
+        if item is None:
+            accounting_queue.task_done()
+            break
+        batch = [item]
+        deadline = time.time() + ACCOUNTING_FLUSH_INTERVAL
+        while len(batch) < ACCOUNTING_BATCH_SIZE:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = accounting_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        try:
+            _flush_accounting_batch(batch)
+        except Exception as e:
+            # Spilling failed too (disk full?); keep the writer alive for the next batch
+            print(f"Lost {len(batch)} accounting records: {e}")
+        finally:
+            for _ in range(len(batch) + (1 if stopping else 0)):
+                accounting_queue.task_done()
+
+def _ensure_accounting_writer():
+    # Started lazily so every gunicorn worker (forked after import) gets its own thread
+    global _accounting_thread, _accounting_pid
+    with _accounting_lock:
+        if _accounting_thread is not None and _accounting_thread.is_alive() and _accounting_pid == os.getpid():
+            return
+        _accounting_thread = threading.Thread(target=accounting_writer, name="accounting-writer", daemon=True)
+        _accounting_pid = os.getpid()
+        _accounting_thread.start()
+
+@atexit.register
+def shutdown_accounting():
+    """Stop the writer and flush anything still queued before the process exits"""
+    if _accounting_thread is not None and _accounting_thread.is_alive() and _accounting_pid == os.getpid():
+        accounting_queue.put(None)
+        _accounting_thread.join(timeout=30)
+    # Anything left (writer never started or died) is written synchronously
+    batch = []
+    while True:
+        try:
+            item = accounting_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not None:
+            batch.append(item)
+    if batch:
+        _flush_accounting_batch(batch)
+
+# Retention - keeps the database small by purging stale rows in small
+# batches, compacting free_transactions and vacuuming incrementally.
+RETENTION_POLICIES = {
+    # cards_generated rows older than this are deleted (card files are gone long before)
+    'cards_generated_days': int(os.environ.get('RETENTION_CARDS_DAYS', 30)),
+    # free_transactions older than this are compacted into one row per user per day
+    'free_transactions_days': int(os.environ.get('RETENTION_TRANSACTIONS_DAYS', 7)),
+    # used or expired password_resets are deleted after this grace period
+    'password_resets_hours': int(os.environ.get('RETENTION_RESETS_HOURS', 24)),
+    # hourly usage rollup rows older than this are deleted (daily rollups are kept)
+    'usage_hourly_days': int(os.environ.get('RETENTION_USAGE_HOURLY_DAYS', 90)),
+}
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', 0.05))
+RETENTION_VACUUM_PAGES = int(os.environ.get('RETENTION_VACUUM_PAGES', 2000))
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+# Holds the time of the last background run; flock'd so one worker per host runs it
+RETENTION_LOCK_PATH = os.path.join(os.getcwd(), "retention.lock")
+
+_retention_lock = threading.Lock()
+_last_retention_run = 0
+
+def _sqlite_cutoff(**delta):
+    # created_at columns hold SQLite CURRENT_TIMESTAMP values (UTC)
+    return (datetime.utcnow() - timedelta(**delta)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _delete_in_batches(conn, table, where, params):
+    deleted = 0
+    while True:
+        with conn:
+            cur = conn.execute(f"DELETE FROM {table} WHERE id IN "
+                               f"(SELECT id FROM {table} WHERE {where} LIMIT ?)",
+                               (*params, RETENTION_BATCH_SIZE))
+        deleted += cur.rowcount
+        if cur.rowcount < RETENTION_BATCH_SIZE:
+            return deleted
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+def retention_mark(conn, name):
+    row = conn.execute("SELECT value FROM retention_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def _set_retention_mark(conn, name, value):
+    conn.execute('''INSERT INTO retention_state (name, value) VALUES (?, ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value''', (name, value))
+
+def _compact_free_transactions(conn, cutoff):
+    """Fold free_transactions of whole days before cutoff into one row per user per day
+
+    SUM(cards_generated) is kept. Days are walked from the stored high-water
+    mark ('free_transactions_compacted', the first day not yet compacted),
+    so compacted history is never scanned again.
+    """
+    day_cutoff = cutoff[:10] + " 00:00:00"
+    start = retention_mark(conn, 'free_transactions_compacted') or ""
+    removed = 0
+    while True:
+        # Next day holding rows, from the created_at index; empty days are skipped
+        row = conn.execute("SELECT MIN(created_at) FROM free_transactions WHERE created_at >= ? AND created_at < ?",
+                           (start, day_cutoff)).fetchone()
+        if row[0] is None:
+            break
+        day_start = row[0][:10] + " 00:00:00"
+        day_end = (datetime.strptime(row[0][:10], "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
+        groups = conn.execute('''SELECT user_id, SUM(cards_generated), COUNT(*) FROM free_transactions
+                                 WHERE created_at >= ? AND created_at < ?
+                                 GROUP BY user_id HAVING COUNT(*) > 1''', (day_start, day_end)).fetchall()
+        for i in range(0, len(groups), RETENTION_BATCH_SIZE):
+            with conn:
+                for user_id, total, count in groups[i:i + RETENTION_BATCH_SIZE]:
+                    conn.execute('''DELETE FROM free_transactions
+                                    WHERE user_id = ? AND created_at >= ? AND created_at < ?''',
+                                 (user_id, day_start, day_end))
+                    conn.execute("INSERT INTO free_transactions (user_id, cards_generated, created_at) VALUES (?, ?, ?)",
+                                 (user_id, total, day_start))
+                    removed += count - 1
+            time.sleep(RETENTION_BATCH_PAUSE)
+        with conn:
+            _set_retention_mark(conn, 'free_transactions_compacted', day_end)
+        start = day_end
+    with conn:
+        _set_retention_mark(conn, 'free_transactions_compacted', max(start, day_cutoff))
+    return removed
+
+def _database_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return page_size * page_count
+
+def run_retention(convert_vacuum=False):
+    """Apply RETENTION_POLICIES, vacuum incrementally and report what was reclaimed
+
+    A database created before incremental vacuum was enabled needs one full
+    VACUUM to switch over. It locks the whole database, so it only runs
+    with convert_vacuum=True (the retention CLI command), never from a web worker.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        size_before = _database_size(conn)
+        # password_resets.expires_at is stored in local time by forgot_password()
+        resets_cutoff = datetime.now() - timedelta(hours=RETENTION_POLICIES['password_resets_hours'])
+        report = {
+            'cards_generated': _delete_in_batches(
+                conn, 'cards_generated', 'created_at < ?',
+                (_sqlite_cutoff(days=RETENTION_POLICIES['cards_generated_days']),)),
+            'free_transactions': _compact_free_transactions(
+                conn, _sqlite_cutoff(days=RETENTION_POLICIES['free_transactions_days'])),
+            'password_resets': _delete_in_batches(
+                conn, 'password_resets', '(used = 1 OR expires_at < ?)',
+                (resets_cutoff.isoformat(sep=' '),)),
+        }
+        hourly_cutoff = _sqlite_cutoff(days=RETENTION_POLICIES['usage_hourly_days'])[:13] + ":00"
+        with conn:
+            report['usage_hourly'] = conn.execute("DELETE FROM usage_hourly WHERE hour < ?",
+                                                  (hourly_cutoff,)).rowcount
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})")
+        elif convert_vacuum:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            print("Retention: incremental vacuum is off, run 'python app.py retention' once to enable it")
+        conn.execute("PRAGMA analysis_limit = 400")
+        conn.execute("ANALYZE")
+
+        size_after = _database_size(conn)
+        report.update(size_before=size_before, size_after=size_after,
+                      reclaimed_bytes=size_before - size_after)
+    finally:
+        conn.close()
+    print(f"Retention: {report}")
+    return report
+
+def run_retention_if_due():
+    """Run retention unless another worker is running it or did within RETENTION_INTERVAL"""
+    with open(RETENTION_LOCK_PATH, "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        f.seek(0)
+        try:
+            last_run = float(f.read() or 0)
+        except ValueError:
+            last_run = 0
+        if time.time() - last_run < RETENTION_INTERVAL:
+            return None
+        f.seek(0)
+        f.truncate()
+        f.write(str(time.time()))
+        f.flush()
+        return run_retention()
+
+def maybe_run_retention():
+    """Start a background retention run once RETENTION_INTERVAL has passed"""
+    global _last_retention_run
+    if RETENTION_INTERVAL <= 0:
+        return
+    # Cheap per-process gate; run_retention_if_due() decides host-wide
+    with _retention_lock:
+        if time.time() - _last_retention_run < RETENTION_INTERVAL:
+            return
+        _last_retention_run = time.time()
+
+    def _run():
+        try:
+            run_retention_if_due()
+        except Exception as e:
+            print(f"Retention run failed: {e}")
+    threading.Thread(target=_run, name="retention", daemon=True).start()
+
+# Usage rollups - per day, per hour and per user per day card counts,
+# kept up to date by the accounting writer so reports never scan raw rows.
+USAGE_REPORT_DAYS = int(os.environ.get('USAGE_REPORT_DAYS', 30))
+USAGE_REPORT_HOURS = int(os.environ.get('USAGE_REPORT_HOURS', 48))
+
+def update_usage_rollups(conn, records):
+    """Add (user_id, created_at) records to the rollups inside the caller's transaction"""
+    daily, hourly, user_daily = Counter(), Counter(), Counter()
+    for user_id, created_at in records:
+        daily[created_at[:10]] += 1
+        hourly[created_at[:13] + ":00"] += 1
+        user_daily[(user_id, created_at[:10])] += 1
+    conn.executemany('''INSERT INTO usage_daily (day, cards) VALUES (?, ?)
+                        ON CONFLICT (day) DO UPDATE SET cards = cards + excluded.cards''',
+                     daily.items())
+    conn.executemany('''INSERT INTO usage_hourly (hour, cards) VALUES (?, ?)
+                        ON CONFLICT (hour) DO UPDATE SET cards = cards + excluded.cards''',
+                     hourly.items())
+    conn.executemany('''INSERT INTO usage_user_daily (user_id, day, cards) VALUES (?, ?, ?)
+                        ON CONFLICT (user_id, day) DO UPDATE SET cards = cards + excluded.cards''',
+                     [(user_id, day, count) for (user_id, day), count in user_daily.items()])
+
+def backfill_usage_rollups():
+    """Rebuild the rollups from free_transactions (one row per card, or per-day totals once compacted)
+
+    Compacted rows no longer carry the hour, so hourly rows before the
+    compaction high-water mark are kept as the writer left them; only
+    later hours are rebuilt.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        # Rows newer than the policy cutoff are never compacted, whether or not a mark is stored yet
+        compacted_until = (retention_mark(conn, 'free_transactions_compacted')
+                           or _sqlite_cutoff(days=RETENTION_POLICIES['free_transactions_days'])[:10] + " 00:00:00")
+        with conn:
+            conn.execute("DELETE FROM usage_daily")
+            conn.execute("DELETE FROM usage_hourly WHERE hour >= ?", (compacted_until[:13] + ":00",))
+            conn.execute("DELETE FROM usage_user_daily")
+            conn.execute('''INSERT INTO usage_daily (day, cards)
+                            SELECT date(created_at), SUM(cards_generated)
+                            FROM free_transactions GROUP BY 1''')
+            conn.execute('''INSERT INTO usage_hourly (hour, cards)
+                            SELECT strftime('%Y-%m-%d %H:00', created_at), SUM(cards_generated)
+                            FROM free_transactions WHERE created_at >= ? GROUP BY 1''', (compacted_until,))
+            conn.execute('''INSERT INTO usage_user_daily (user_id, day, cards)
+                            SELECT user_id, date(created_at), SUM(cards_generated)
+                            FROM free_transactions GROUP BY 1, 2''')
+        days = conn.execute("SELECT COUNT(*), COALESCE(SUM(cards), 0) FROM usage_daily").fetchone()
+    finally:
+        conn.close()
+    print(f"Usage rollups rebuilt: {days[0]} days, {days[1]} cards")
+    return days
+
+def load_usage_report(days=USAGE_REPORT_DAYS, hours=USAGE_REPORT_HOURS):
+    """Read the admin report straight from the rollups (bounded by days/hours, not by history)"""
+    now = datetime.utcnow()
+    since_day = (now - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    since_hour = (now - timedelta(hours=hours - 1)).strftime('%Y-%m-%d %H:00')
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        daily = conn.execute("SELECT day, cards FROM usage_daily WHERE day >= ? ORDER BY day",
+                             (since_day,)).fetchall()
+        hourly = conn.execute("SELECT hour, cards FROM usage_hourly WHERE hour >= ? ORDER BY hour",
+                              (since_hour,)).fetchall()
+        users = conn.execute('''SELECT u.username, SUM(r.cards) AS cards
+                                FROM usage_user_daily r JOIN users u ON u.id = r.user_id
+                                WHERE r.day >= ? GROUP BY r.user_id
+                                ORDER BY cards DESC LIMIT 20''', (since_day,)).fetchall()
+    finally:
+        conn.close()
+    return {'daily': daily, 'hourly': hourly, 'users': users}
+
 def generate_transaction_id():
     return f"FREE_{uuid.uuid4().hex[:8].upper()}_{int(time.time())}"
 
+# Memory-bounded rendering. Background removal runs on Pillow's C code
+# (no per-pixel Python tuples). With RENDER_MEMORY_BUDGET_MB set, large
+# JPEGs are decoded at reduced size (never below the size drawn on the card);
+# other formats cannot decode smaller, so oversized ones are refused before
+# their pixels are read.
+RENDER_MEMORY_BUDGET_MB = float(os.environ.get('RENDER_MEMORY_BUDGET_MB', 0))  # 0 = full resolution
+RENDER_MEMORY_TRACE = os.environ.get('RENDER_MEMORY_TRACE', '0') == '1'  # tracemalloc costs CPU, opt-in
+RENDER_MEMORY_HISTORY = deque(maxlen=200)
+
+_WHITE_LUT = [255 if v > 220 else 0 for v in range(256)]
+
+def remove_white_background(img):
+    """Make near-white pixels (R, G and B > 220) transparent white, like the old getdata loop"""
+    img = img.convert("RGBA")
+    r, g, b, _ = img.split()
+    white = ImageChops.darker(ImageChops.darker(r.point(_WHITE_LUT), g.point(_WHITE_LUT)), b.point(_WHITE_LUT))
+    del r, g, b
+    img.paste((255, 255, 255, 0), None, white)
+    return img
+
+class PhotoTooLarge(ValueError):
+    pass
+
+def open_photo(path, target_size, draft=False):
+    """Open a photo as RGBA, decoding it smaller when it would not fit the memory budget
+
+    Raises PhotoTooLarge for a non-JPEG photo over the budget: Image.open
+    only reads the header, so the size is checked before anything is
+    decoded. draft=True (previews) always decodes as small as target_size allows.
+    """
+    img = Image.open(path)
+    if draft:
+        img.draft('RGB', target_size)  # JPEG only: DCT scaling, stays >= target_size
+        factor = min(img.width // target_size[0], img.height // target_size[1])
+        if factor > 1:
+            img = img.reduce(factor)
+    elif RENDER_MEMORY_BUDGET_MB:
+        # decoded, RGBA and mask copies are alive together, so allow a quarter of the budget each
+        limit = RENDER_MEMORY_BUDGET_MB * 1024 * 1024 / 4
+        if img.width * img.height * 4 > limit:
+            img.draft('RGB', target_size)
+            # Still at least twice the card size: the format has no reduced decode,
+            # and reducing afterwards would need the full-size buffer first
+            if img.width * img.height * 4 > limit and min(img.width // target_size[0],
+                                                           img.height // target_size[1]) > 1:
+                raise PhotoTooLarge(f"{img.width}x{img.height} {img.format} photo does not fit "
+                                    f"RENDER_MEMORY_BUDGET_MB={RENDER_MEMORY_BUDGET_MB:g}")
+    return img.convert("RGBA")
+
+def _reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM so the peak is per request
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class measure_render_memory:
+    """Collect peak RSS (and tracemalloc peak when enabled) for one render
+
+    Figures are per process, so concurrent threads in one worker share them.
+    """
+    def __enter__(self):
+        self.stats = {}
+        self._per_request = _reset_peak_rss()
+        if RENDER_MEMORY_TRACE:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._started = time.time()
+        return self.stats
+
+    def __exit__(self, *exc):
+        self.stats['seconds'] = round(time.time() - self._started, 3)
+        self.stats['peak_rss_kb'] = _peak_rss_kb()
+        self.stats['peak_rss_per_request'] = self._per_request
+        if RENDER_MEMORY_TRACE and tracemalloc.is_tracing():
+            self.stats['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        RENDER_MEMORY_HISTORY.append(self.stats)
+        return False
+
+# Per-request profiling. An admin can ask for one /generate request to be
+# run under cProfile (X-Profile: 1 header or ?profile=1) when PROFILING_ENABLED
+# is set; mark_stage() records the pipeline stage boundaries in the capture.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILE_FOLDER = os.environ.get('PROFILE_FOLDER', 'profiles')
+
+_render_local = threading.local()
+
+def mark_stage(name):
+    """Mark the start of a pipeline stage for whatever is watching this render"""
+    profile = getattr(_render_local, 'profile', None)
+    if profile is not None:
+        profile['stages'].append((name, round(time.perf_counter() - profile['started'], 4)))
+    check_deadline(name)
+
+# Request deadline. /generate gets a time budget (below the gunicorn timeout)
+# that is checked at every stage boundary, so a pathological PDF fails fast
+# instead of the worker being killed mid-write. Optional work (the OCR
+# fallback) is skipped when too little budget is left.
+RENDER_DEADLINE_SECONDS = float(os.environ.get('RENDER_DEADLINE_SECONDS', 25))  # 0 = no deadline
+OCR_MIN_SECONDS = float(os.environ.get('OCR_MIN_SECONDS', 5))
+
+class RenderDeadlineExceeded(Exception):
+    pass
+
+@contextmanager
+def render_deadline(seconds=RENDER_DEADLINE_SECONDS):
+    """Give the render running on this thread `seconds` to finish"""
+    _render_local.deadline = time.monotonic() + seconds if seconds else None
+    _render_local.budget = seconds
+    try:
+        yield
+    finally:
+        _render_local.deadline = None
+        _render_local.budget = None
+
+def remaining_budget():
+    """Seconds left before the deadline, or None when there is no deadline"""
+    deadline = getattr(_render_local, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+def check_deadline(stage):
+    remaining = remaining_budget()
+    if remaining is not None and remaining <= 0:
+        raise RenderDeadlineExceeded(f"Time budget of {_render_local.budget:g}s used up before '{stage}'")
+
+def profiling_requested():
+    if not PROFILING_ENABLED or not is_admin():
+        return False
+    return request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+
+@contextmanager
+def request_profile(label):
+    """Run the block under cProfile if the current request asked for it, yielding the capture or None"""
+    if not profiling_requested():
+        yield None
+        return
+    profile = {'id': f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}",
+               'user': session.get('username'), 'stages': [], 'started': time.perf_counter()}
+    profiler = cProfile.Profile()
+    _render_local.profile = profile
+    profiler.enable()
+    try:
+        yield profile
+    finally:
+        profiler.disable()
+        _render_local.profile = None
+        profile['total'] = round(time.perf_counter() - profile['started'], 4)
+        save_request_profile(profile, profiler)
+
+def save_request_profile(profile, profiler):
+    """Write <id>.prof (pstats) and <id>.txt (stage timings + top functions) to PROFILE_FOLDER"""
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    base = os.path.join(PROFILE_FOLDER, profile['id'])
+    profiler.dump_stats(base + '.prof')
+
+    summary = StringIO()
+    summary.write(f"user: {profile['user']}\ntotal: {profile['total']}s\n\nstages (start offset, duration):\n")
+    boundaries = profile['stages'] + [('end', profile['total'])]
+    for (name, start), (_, end) in zip(boundaries, boundaries[1:]):
+        summary.write(f"  {name:<20} {start:>8.3f}s {end - start:>8.3f}s\n")
+    summary.write("\n")
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+    with open(base + '.txt', 'w') as f:
+        f.write(summary.getvalue())
+
+# Shared cache tier - an on-disk SQLite store every gunicorn worker on the
+# host reads and writes, so parsed PDFs and processed photos stay warm no
+# matter which worker gets the request. Least recently used entries are
+# evicted once SHARED_CACHE_MAX_MB is exceeded.
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', os.path.join(os.getcwd(), "cache.db"))
+SHARED_CACHE_MAX_MB = float(os.environ.get('SHARED_CACHE_MAX_MB', 256))  # 0 = disabled
+SHARED_CACHE_TOUCH_INTERVAL = 60  # seconds between access-time updates of a hot entry
+# Part of the cached extraction key: bump whenever extract_pdf_data's output
+# can change, so results from an older extractor are not served after a deploy
+EXTRACTION_VERSION = 2  # 2: scanned pages are OCR'd region by region
+
+class SharedCache:
+    """Byte values by string key, shared between processes through one SQLite file
+
+    The file is created on first use, so importing app doesn't create it.
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._ready = False
+
+    def _create(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS cache
+                            (key TEXT PRIMARY KEY,
+                             value BLOB NOT NULL,
+                             size INTEGER NOT NULL,
+                             accessed REAL NOT NULL)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (id INTEGER PRIMARY KEY CHECK (id = 1), total INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO cache_meta (id, total) VALUES (1, 0)")
+            conn.commit()
+        finally:
+            conn.close()
+        self._ready = True
+
+    def _connect(self):
+        if not self._ready:
+            self._create()
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        if not self.max_bytes:
+            return None
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value, accessed FROM cache WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                if row is not None and row[1] < now - SHARED_CACHE_TOUCH_INTERVAL:
+                    with conn:
+                        conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Shared cache read failed: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, value):
+        if not self.max_bytes or len(value) > self.max_bytes:
+            return
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    # Take the write lock before reading the old size, or two workers storing
+                    # the same key both see it missing and both add it to the total
+                    conn.execute("BEGIN IMMEDIATE")
+                    old = conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+                    conn.execute("INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                                 (key, value, len(value), time.time()))
+                    conn.execute("UPDATE cache_meta SET total = total + ? WHERE id = 1",
+                                 (len(value) - (old[0] if old else 0),))
+                    self._evict(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Shared cache write failed: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT total FROM cache_meta WHERE id = 1").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims, freed = [], 0
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed"):
+            victims.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+        conn.execute("UPDATE cache_meta SET total = total - ? WHERE id = 1", (freed,))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {'hits': self.hits, 'misses': self.misses,
+                 'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                 'max_bytes': self.max_bytes}
+        if self.max_bytes:
+            conn = self._connect()
+            try:
+                stats['entries'] = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+                stats['bytes'] = conn.execute("SELECT total FROM cache_meta WHERE id = 1").fetchone()[0]
+            finally:
+                conn.close()
+        return stats
+
+shared_cache = SharedCache(SHARED_CACHE_PATH, int(SHARED_CACHE_MAX_MB * 1024 * 1024))
+
+def upload_digest(uploaded_file):
+    """sha256 of an uploaded file, leaving the stream at the start"""
+    digest = hashlib.sha256()
+    uploaded_file.stream.seek(0)
+    for chunk in iter(lambda: uploaded_file.stream.read(64 * 1024), b""):
+        digest.update(chunk)
+    uploaded_file.stream.seek(0)
+    return digest.hexdigest()
+
+def extract_pdf_cached(pdf_path, pdf_key, ocr=True):
+    """extract_all_images + extract_pdf_data through the shared cache
+
+    Only the first embedded image is kept, as it is the only one the card uses.
+    An extraction cut short by the time budget or a failed OCR is not cached.
+    """
+    key = f"pdf:v{EXTRACTION_VERSION}:{pdf_key}:{int(ocr)}"
+    meta = shared_cache.get(key)
+    if meta is not None:
+        meta = json.loads(meta)
+        image_bytes = shared_cache.get(f"{key}:img") if meta['image_ext'] else None
+        if image_bytes is not None or not meta['image_ext']:
+            extracted_images = []
+            if image_bytes is not None:
+                path = os.path.join(IMG_FOLDER, f"page1_img0_{uuid.uuid4().hex[:5]}.{meta['image_ext']}")
+                with open(path, "wb") as f:
+                    f.write(image_bytes)
+                extracted_images.append(path)
+            return extracted_images, meta['data']
+
+    extracted_images = extract_all_images(pdf_path)
+    data, complete = extract_pdf_data(pdf_path, extracted_images, ocr=ocr)
+    if not complete:
+        # Blank fields from a cut-short OCR would be served to every later upload of this PDF
+        return extracted_images, data
+    image_ext = None
+    if extracted_images:
+        image_ext = os.path.splitext(extracted_images[0])[1].lstrip(".")
+        with open(extracted_images[0], "rb") as f:
+            shared_cache.put(f"{key}:img", f.read())
+    shared_cache.put(key, json.dumps({'data': data, 'image_ext': image_ext}).encode())
+    return extracted_images, data
+
 def save_user_uploaded_image(uploaded_file):
     if not uploaded_file or uploaded_file.filename == '':
         return None
@@ -138,29 +944,36 @@ def save_user_uploaded_image(uploaded_file):
         elif filename.endswith('.tiff'):
             ext = 'tiff'
         
+        png_path = os.path.join(IMG_FOLDER, f"page2_img0_{unique_id}.png")
+        backend = image_backend()
+        # Processed photos depend on the memory budget (reduced decode) and the backend, so both are part of the key
+        cache_key = f"photo:{upload_digest(uploaded_file)}:{RENDER_MEMORY_BUDGET_MB}:{backend.name}"
+        cached_png = shared_cache.get(cache_key)
+        if cached_png is not None:
+            with open(png_path, "wb") as f:
+                f.write(cached_png)
+            return png_path
+        
         img_name = f"page2_img0_{unique_id}.{ext}"
         save_path = os.path.join(IMG_FOLDER, img_name)
         uploaded_file.save(save_path)
         
         try:
-            img = Image.open(save_path).convert("RGBA")
-            datas = img.getdata()
-            newData = []
-            for item in datas:
-                if item[0] > 220 and item[1] > 220 and item[2] > 220:
-                    newData.append((255, 255, 255, 0))
-                else:
-                    newData.append(item)
-            img.putdata(newData)
+            img = backend.process_upload(save_path)
             
-            png_path = os.path.join(IMG_FOLDER, f"page2_img0_{unique_id}.png")
-            img.save(png_path, "PNG")
+            backend.save_layer(img, png_path)
+            with open(png_path, "rb") as f:
+                shared_cache.put(cache_key, f.read())
             
             if ext != 'png':
                 os.remove(save_path)
                 save_path = png_path
             
             return save_path
+        except PhotoTooLarge as e:
+            print(f"Rejected uploaded image: {e}")
+            os.remove(save_path)
+            return None
         except Exception as e:
             print(f"Error processing uploaded image: {e}")
             return save_path
@@ -182,11 +995,12 @@ def prepare_images_for_card(extracted_images, user_photo_path):
     return image_paths
 
 # 5. PDF PROCESSING FUNCTIONS
-def extract_all_images(pdf_path):
+def extract_all_images(pdf_path, out_dir=IMG_FOLDER):
     doc = fitz.open(pdf_path)
     image_paths = []
     
     for page_index in range(len(doc)):
+        check_deadline("extract_images")
         page = doc[page_index]
         image_list = page.get_images(full=True)
         
@@ -197,7 +1011,7 @@ def extract_all_images(pdf_path):
             ext = base_image["ext"]
             
             img_name = f"page{page_index+1}_img{img_index}_{uuid.uuid4().hex[:5]}.{ext}"
-            path = os.path.join(IMG_FOLDER, img_name)
+            path = os.path.join(out_dir, img_name)
             
             with open(path, "wb") as f:
                 f.write(image_bytes)
@@ -206,158 +1020,738 @@ def extract_all_images(pdf_path):
     doc.close()
     return image_paths
 
-def extract_pdf_data(pdf_path, image_paths):
+# Field rectangles on page 1 (PDF points); multiline fields use "| " as the line break
+PDF_FIELDS = {
+    "fullname": (fitz.Rect(50, 360, 300, 372), True),
+    "dob": (fitz.Rect(50, 430, 300, 435), False),
+    "sex": (fitz.Rect(50, 500, 300, 510), False),
+    "nationality": (fitz.Rect(50, 560, 300, 575), False),
+    "phone": (fitz.Rect(50, 600, 300, 625), False),
+    "region": (fitz.Rect(50, 400, 300, 410), True),
+    "zone": (fitz.Rect(50, 460, 400, 470), True),
+    "woreda": (fitz.Rect(50, 527, 300, 537), True),
+}
+
+# Scanned (image-only) PDFs - the page is rasterized once and every field
+# region is OCR'd in parallel, so latency is that of the slowest region.
+SCANNED_OCR_ENABLED = os.environ.get('SCANNED_OCR_ENABLED', '1') == '1'
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 2))
+OCR_TEXT_LANG = os.environ.get('OCR_TEXT_LANG', 'amh+eng')
+OCR_REGION_PADDING = 3  # points added around each field rectangle
+# field -> (tesseract languages, tesseract config); "page" is the full-page pass for FIN/FAN
+OCR_REGION_CONFIG = {
+    "fullname": (OCR_TEXT_LANG, "--psm 7"),
+    "dob": ("eng", "--psm 7"),
+    "sex": (OCR_TEXT_LANG, "--psm 7"),
+    "nationality": (OCR_TEXT_LANG, "--psm 7"),
+    "phone": ("eng", "--psm 7 -c tessedit_char_whitelist=0123456789+"),
+    "region": (OCR_TEXT_LANG, "--psm 7"),
+    "zone": (OCR_TEXT_LANG, "--psm 7"),
+    "woreda": (OCR_TEXT_LANG, "--psm 7"),
+    "page": ("eng", "--psm 3"),
+}
+
+_ocr_pool = None
+_ocr_pool_pid = None
+_ocr_pool_lock = threading.Lock()
+
+def ocr_pool():
+    # tesseract runs as a subprocess, so threads are enough to use every core
+    global _ocr_pool, _ocr_pool_pid
+    with _ocr_pool_lock:
+        if _ocr_pool is None or _ocr_pool_pid != os.getpid():
+            _ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+            _ocr_pool_pid = os.getpid()
+        return _ocr_pool
+
+def _ocr_region(img, lang, config, deadline):
+    """Text in img, or None when OCR failed or there was no time budget left to run it"""
+    # The job may have waited in the pool queue, so its timeout is whatever is left when it starts
+    timeout = 0 if deadline is None else deadline - time.monotonic()  # 0 = no timeout
+    if deadline is not None and timeout <= 0:
+        return None
+    try:
+        return pytesseract.image_to_string(img, lang=lang, config=config, timeout=timeout).strip()
+    except Exception as e:
+        print(f"OCR failed ({lang}, {config}): {e}")
+        return None
+
+def ocr_page_regions(page):
+    """OCR every PDF_FIELDS region and the whole page of an image-only page
+
+    Returns ({field: text}, full page text, complete). Fields are left
+    blank when the time budget is too short to start OCR or runs out before
+    their region is read, or when tesseract fails; complete is then False.
+    """
+    deadline = getattr(_render_local, 'deadline', None)
+    remaining = remaining_budget()
+    if remaining is not None and remaining < OCR_MIN_SECONDS:
+        print(f"Skipping scanned-page OCR, only {remaining:.1f}s of the time budget left")
+        return {}, "", False
+    
+    mark_stage("ocr_rasterize")
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+    page_img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    del pix
+    scale = OCR_DPI / 72
+    
+    mark_stage("ocr_regions")
+    # The full page is the slowest job, start it first
+    lang, config = OCR_REGION_CONFIG["page"]
+    futures = {"page": ocr_pool().submit(_ocr_region, page_img, lang, config, deadline)}
+    for field, (rect, _) in PDF_FIELDS.items():
+        box = (int((rect.x0 - OCR_REGION_PADDING) * scale), int((rect.y0 - OCR_REGION_PADDING) * scale),
+               int((rect.x1 + OCR_REGION_PADDING) * scale), int((rect.y1 + OCR_REGION_PADDING) * scale))
+        lang, config = OCR_REGION_CONFIG[field]
+        futures[field] = ocr_pool().submit(_ocr_region, page_img.crop(box), lang, config, deadline)
+    
+    _, not_done = wait(futures.values(), timeout=remaining_budget())
+    for future in not_done:
+        future.cancel()
+    if not_done:
+        print(f"Scanned-page OCR ran out of time budget, {len(not_done)} of {len(futures)} regions left blank")
+    texts = {field: future.result() if future not in not_done else None for field, future in futures.items()}
+    complete = None not in texts.values()
+    texts = {field: text or "" for field, text in texts.items()}
+    page_text = texts.pop("page")
+    return texts, page_text, complete
+
+def extract_pdf_data(pdf_path, image_paths, ocr=True):
+    """Read the card fields from the PDF; returns (data, complete)
+
+    complete is False when OCR was skipped for lack of time budget or failed,
+    so the fields may be blank or "Hin Argamne" only because of this run.
+    """
+    mark_stage("extract_text")
     doc = fitz.open(pdf_path)
     page = doc[0]
     full_text = page.get_text("text")
+    
+    # No text layer: a scanned PDF, read the fields with OCR instead
+    ocr_texts = None
+    complete = True
+    if SCANNED_OCR_ENABLED and not full_text.strip():
+        ocr_texts, full_text, complete = ocr_page_regions(page)
 
     fin_matches = re.findall(r"\b\d{4}\s\d{4}\s\d{4}\b", full_text)
     fin_number = fin_matches[-1].strip() if fin_matches else None
 
-    if not fin_number:
+    remaining = remaining_budget()
+    if not fin_number and not ocr:
+        # The caller already has the FIN (typed into the form), OCR would be wasted
+        pass
+    elif not fin_number and remaining is not None and remaining < OCR_MIN_SECONDS:
+        # Not enough budget left for the OCR fallback; the card gets "FIN not found"
+        print(f"Skipping FIN OCR, only {remaining:.1f}s of the time budget left")
+        complete = False
+    elif not fin_number:
+        mark_stage("ocr")
         for path in image_paths:
             if "page1_img3" in os.path.basename(path):
                 try:
                     img = Image.open(path).convert('L')
-                    image_text = pytesseract.image_to_string(img)
+                    remaining = remaining_budget()
+                    # pytesseract kills tesseract and raises once the timeout passes (0 = no timeout)
+                    image_text = pytesseract.image_to_string(img, timeout=0 if remaining is None else max(remaining, 1))
                     img_fin = re.findall(r"\b\d{4}\s\d{4}\s\d{4}\b", image_text)
                     if img_fin:
                         fin_number = img_fin[0].strip()
                         break
                 except:
-                    pass
+                    complete = False
 
     if not fin_number: fin_number = "Hin Argamne"
+    mark_stage("extract_fields")
 
     fan_matches = re.findall(r"\b\d{4}\s\d{4}\s\d{4}\s\d{4}\b", full_text)
     fan_number = fan_matches[0].replace(" ", "") if fan_matches else "Hin Argamne"
 
-    fullname_text = page.get_textbox(fitz.Rect(50, 360, 300, 372)).strip()
-    fullname_fixed = fullname_text.replace("| ", "\n")
-    
-    dob_text = page.get_textbox(fitz.Rect(50, 430, 300, 435)).strip()
-    sex_text = page.get_textbox(fitz.Rect(50, 500, 300, 510)).strip()
-    nationality_text = page.get_textbox(fitz.Rect(50, 560, 300, 575)).strip()
-    
-    region_text = page.get_textbox(fitz.Rect(50, 400, 300, 410)).strip()
-    region_fixed = region_text.replace("| ", "\n")
-    
-    zone_text = page.get_textbox(fitz.Rect(50, 460, 400, 470)).strip()
-    zone_fixed = zone_text.replace("| ", "\n")
-    
-    woreda_text = page.get_textbox(fitz.Rect(50, 527, 300, 537)).strip()
-    woreda_fixed = woreda_text.replace("| ", "\n")
-
-    data = {
-        "fullname": fullname_fixed,
-        "dob": dob_text,
-        "sex": sex_text,
-        "nationality": nationality_text,
-        "phone": page.get_textbox(fitz.Rect(50, 600, 300, 625)).strip(),
-        "region": region_fixed,
-        "zone": zone_fixed,
-        "woreda": woreda_fixed,
-        "fan": fan_number,
-    }
+    data = {}
+    for field, (rect, multiline) in PDF_FIELDS.items():
+        if ocr_texts is not None:
+            text = ocr_texts.get(field, "")
+        else:
+            text = page.get_textbox(rect).strip()
+        data[field] = text.replace("| ", "\n") if multiline else text
+    data["fan"] = fan_number
+    data["fin"] = fin_number
     doc.close()
-    return data
+    return data, complete
 
-def generate_card(data, image_paths, fin_number):
-    card = Image.open(TEMPLATE_PATH).convert("RGBA")
-    draw = ImageDraw.Draw(card)
+# Text bitmap cache - fields that repeat across cards (nationality, sex,
+# region, zone, woreda, the date strings) are rasterized once and pasted.
+TEXT_CACHE_SIZE = int(os.environ.get('TEXT_CACHE_SIZE', 512))
 
-    now = datetime.now()
-    gc_issued = now.strftime("%d/%m/%Y")
-    eth_issued_obj = EthiopianDateConverter.to_ethiopian(now.year, now.month, now.day)
-    ec_issued = f"{eth_issued_obj.day:02d}/{eth_issued_obj.month:02d}/{eth_issued_obj.year}"
-    
-    gc_expiry = now.replace(year=now.year + 8).strftime("%d/%m/%Y")
-    ec_expiry = f"{eth_issued_obj.day:02d}/{eth_issued_obj.month:02d}/{eth_issued_obj.year + 8}"
-    expiry_full = f"{gc_expiry} | {ec_expiry}"
+@lru_cache(maxsize=None)
+def load_font(size):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except:
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_mask(text, size, spacing=4):
+    """Rasterize text to an L mask; returns (mask, offset of the mask from the draw position)"""
+    font = load_font(size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox(
+        (0, 0), text, font=font, spacing=spacing)
+    left, top = math.floor(left), math.floor(top)
+    mask = Image.new("L", (max(math.ceil(right) - left, 1), max(math.ceil(bottom) - top, 1)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font, spacing=spacing)
+    return mask, (left, top)
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def rotated_text_image(text, size, angle, color="black"):
+    """Text drawn on a transparent image and rotated, pasted with itself as the mask"""
+    font = load_font(size)
+    text_bbox = font.getbbox(text)
+    txt_img = Image.new("RGBA", (text_bbox[2], text_bbox[3] + 10), (255, 255, 255, 0))
+    ImageDraw.Draw(txt_img).text((0, 0), text, fill=color, font=font)
+    return txt_img.rotate(angle, expand=True)
+
+# Per-card values (names, numbers) would only churn the cache
+render_text_mask = text_mask.__wrapped__
+
+def text_cache_stats():
+    stats = {}
+    for name, cached in (('text_mask', text_mask), ('rotated_text', rotated_text_image)):
+        info = cached.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {'hits': info.hits, 'misses': info.misses, 'size': info.currsize,
+                       'maxsize': info.maxsize, 'hit_ratio': round(info.hits / lookups, 3) if lookups else None}
+    return stats
+
+def process_card_photos(image_paths, draft=False):
+    """Decode, clean and resize the photos into the layers pasted on the card
+
+    Returns {'photo_large', 'photo_small', 'new_photo': RGBA image}; a photo
+    that is missing or fails to load is left out. PhotoTooLarge is raised
+    rather than leaving the photo out, so the card is refused instead of
+    going out without a face.
+    """
+    resample = Image.NEAREST if draft else None
+    photos = {}
 
     # Original photo
     if len(image_paths) > 0 and image_paths[0] is not None:
         try:
-            original_photo = Image.open(image_paths[0]).convert("RGBA")
-            datas = original_photo.getdata()
-            newData = []
-            for item in datas:
-                if item[0] > 220 and item[1] > 220 and item[2] > 220:
-                    newData.append((255, 255, 255, 0))
-                else:
-                    newData.append(item)
-            original_photo.putdata(newData)
-            
-            p_large = original_photo.resize((310, 400))
-            card.paste(p_large, (65, 200), p_large)
-            
-            p_small = original_photo.resize((100, 135))
-            card.paste(p_small, (800, 450), p_small)
+            original_photo = remove_white_background(open_photo(image_paths[0], (310, 400), draft))
+            photos['photo_large'] = original_photo.resize((310, 400), resample)
+            photos['photo_small'] = original_photo.resize((100, 135), resample)
+            del original_photo
+        except PhotoTooLarge:
+            raise
         except Exception as e:
             print(f"Error processing original photo: {e}")
 
     # New photo
     if len(image_paths) > 1 and image_paths[1] is not None:
         try:
-            new_photo = Image.open(image_paths[1]).convert("RGBA")
-            datas = new_photo.getdata()
-            newData = []
-            for item in datas:
-                if item[0] > 220 and item[1] > 220 and item[2] > 220:
-                    newData.append((255, 255, 255, 0))
-                else:
-                    newData.append(item)
-            new_photo.putdata(newData)
-            
-            new_resized = new_photo.resize((530, 550))
-            card.paste(new_resized, (1550, 30), new_resized)
+            new_photo = remove_white_background(open_photo(image_paths[1], (530, 550), draft))
+            photos['new_photo'] = new_photo.resize((530, 550), resample)
+            del new_photo
+        except PhotoTooLarge:
+            raise
         except Exception as e:
             print(f"Error processing new photo: {e}")
 
-    # FIN number
+    return photos
+
+def card_layers(data, fin_number, photos, issued, serial):
+    """The card's layers in paint order, as (name, box, image, color)
+
+    With color None, image is RGBA and pasted with itself as the mask;
+    otherwise image is an L mask filled with color. box[:2] is where the
+    image goes on the card. Repeating text (nationality, sex, address,
+    dates) comes from the text bitmap cache.
+    """
+    gc_issued = issued.strftime("%d/%m/%Y")
+    eth_issued_obj = EthiopianDateConverter.to_ethiopian(issued.year, issued.month, issued.day)
+    ec_issued = f"{eth_issued_obj.day:02d}/{eth_issued_obj.month:02d}/{eth_issued_obj.year}"
+    
+    gc_expiry = issued.replace(year=issued.year + 8).strftime("%d/%m/%Y")
+    ec_expiry = f"{eth_issued_obj.day:02d}/{eth_issued_obj.month:02d}/{eth_issued_obj.year + 8}"
+    expiry_full = f"{gc_expiry} | {ec_expiry}"
+
+    layers = []
+
+    def image(name, xy, img):
+        if img is not None:
+            layers.append((name, (xy[0], xy[1], xy[0] + img.width, xy[1] + img.height), img, None))
+
+    def text(name, xy, value, size, spacing=4, cached=False):
+        if value:
+            mask, (dx, dy) = (text_mask if cached else render_text_mask)(value, size, spacing)
+            box = (xy[0] + dx, xy[1] + dy, xy[0] + dx + mask.width, xy[1] + dy + mask.height)
+            layers.append((name, box, mask, "black"))
+
+    image('photo_large', (65, 200), photos.get('photo_large'))
+    image('photo_small', (800, 450), photos.get('photo_small'))
+    image('new_photo', (1550, 30), photos.get('new_photo'))
+    text('fin', (1265, 545), fin_number, 25)
+    text('fullname', (405, 170), data["fullname"], 37, spacing=8)
+    text('dob', (405, 305), data["dob"], 32)
+    text('sex', (405, 375), data["sex"], 32, cached=True)
+    text('nationality', (1130, 165), data["nationality"], 32, cached=True)
+    text('region', (1130, 235), data["region"], 28, spacing=5, cached=True)
+    text('zone', (1130, 315), data["zone"], 28, spacing=5, cached=True)
+    text('woreda', (1130, 390), data["woreda"], 28, spacing=5, cached=True)
+    text('phone', (1130, 65), data["phone"], 32)
+    text('fan', (470, 500), data["fan"], 32)
+    text('expiry', (405, 440), expiry_full, 32, cached=True)
+    text('serial', (1930, 595), f" {serial}", 26)
+    image('issued_gc', (13, 120), rotated_text_image(gc_issued, 25, 90))
+    image('issued_ec', (13, 390), rotated_text_image(ec_issued, 25, 90))
+    return layers
+
+def paint_layer(canvas, layer, origin=(0, 0)):
+    """Paste one layer with Pillow; canvas's top-left corner sits at origin on the card"""
+    _, box, image, color = layer
+    x, y = box[0] - origin[0], box[1] - origin[1]
+    if color is None:
+        canvas.paste(image, (x, y), image)
+    else:
+        canvas.paste(color, (x, y, x + image.width, y + image.height), image)
+
+# Image backends - photo processing, compositing and encoding of full
+# renders. Pillow is the default; IMAGE_BACKEND=vips uses libvips (pip
+# install pyvips), which streams the card and runs on several threads.
+# Text is always rasterized by Pillow, and edits (rerender_card) always
+# repaint with Pillow.
+IMAGE_BACKEND = os.environ.get('IMAGE_BACKEND', 'pillow')
+
+class PillowBackend:
+    name = 'pillow'
+
+    def process_photos(self, image_paths, draft=False):
+        return process_card_photos(image_paths, draft)
+
+    def process_upload(self, path):
+        """An uploaded new photo, decoded within the memory budget and cleaned, at full size"""
+        return remove_white_background(open_photo(path, (530, 550)))
+
+    def compose(self, layers):
+        card = Image.open(TEMPLATE_PATH).convert("RGBA")
+        for layer in layers:
+            paint_layer(card, layer)
+        return card
+
+    def to_pil(self, card):
+        return card
+
+    def save_card(self, card, path):
+        rgb_card = card.convert("RGB")
+        del card
+        rgb_card.save(path, "PNG")
+
+    def save_layer(self, img, path):
+        img.save(path, "PNG")
+
+class VipsBackend:
+    name = 'vips'
+
+    def __init__(self):
+        # id(PIL layer) -> vips copy, dropped when the PIL image is freed, so
+        # the text masks and rotated dates held by the text bitmap cache are
+        # converted once rather than for every card
+        self._converted = {}
+
+    def _clean(self, img):
+        """Same steps as remove_white_background"""
+        img = img.colourspace("srgb").cast("uchar")
+        if not img.hasalpha():
+            img = img.bandjoin_const([255])
+        white = (img[0:3] > 220).bandand()
+        return white.ifthenelse([255, 255, 255, 0], img)
+
+    def _photo(self, path, size, draft):
+        """Same steps as open_photo + remove_white_background + resize"""
+        if draft:
+            img = pyvips.Image.thumbnail(path, size[0], height=size[1], size="force")
+        else:
+            img = pyvips.Image.new_from_file(path)
+        img = self._clean(img)
+        # Resize premultiplied so the colour of transparent (white) pixels doesn't bleed into the edges
+        img = img.premultiply().resize(size[0] / img.width, vscale=size[1] / img.height, kernel="cubic")
+        return img.unpremultiply().cast("uchar")
+
+    def process_photos(self, image_paths, draft=False):
+        photos = {}
+        if len(image_paths) > 0 and image_paths[0] is not None:
+            try:
+                # copy_memory() evaluates now, so a bad file fails here rather than at save
+                photos['photo_large'] = self._photo(image_paths[0], (310, 400), draft).copy_memory()
+                photos['photo_small'] = self._photo(image_paths[0], (100, 135), draft).copy_memory()
+            except pyvips.Error as e:
+                print(f"Error processing original photo: {e}")
+        if len(image_paths) > 1 and image_paths[1] is not None:
+            try:
+                photos['new_photo'] = self._photo(image_paths[1], (530, 550), draft).copy_memory()
+            except pyvips.Error as e:
+                print(f"Error processing new photo: {e}")
+        return photos
+
+    def process_upload(self, path):
+        return self._clean(pyvips.Image.new_from_file(path, access="sequential"))
+
+    def _from_pil(self, img):
+        key = id(img)
+        converted = self._converted.get(key)
+        if converted is None:
+            converted = pyvips.Image.new_from_memory(img.tobytes(), img.width, img.height,
+                                                     len(img.getbands()), "uchar")
+            self._converted[key] = converted
+            weakref.finalize(img, self._converted.pop, key, None)
+        return converted
+
+    def compose(self, layers):
+        card = pyvips.Image.new_from_file(TEMPLATE_PATH, access="sequential").colourspace("srgb")
+        if not card.hasalpha():
+            card = card.bandjoin_const([255])
+        overlays, xs, ys = [], [], []
+        for _, box, image, color in layers:
+            if not isinstance(image, pyvips.Image):
+                image = self._from_pil(image)
+            if color is not None:
+                image = image.new_from_image(list(ImageColor.getrgb(color))).bandjoin(image)
+            overlays.append(image.copy(interpretation="srgb"))
+            xs.append(box[0])
+            ys.append(box[1])
+        if overlays:
+            card = card.composite(overlays, ["over"] * len(overlays), x=xs, y=ys).cast("uchar")
+        return card
+
+    def to_pil(self, card):
+        return Image.frombytes("RGBA", (card.width, card.height), card.write_to_memory())
+
+    def save_card(self, card, path):
+        card[0:3].pngsave(path)
+
+    def save_layer(self, img, path):
+        img.pngsave(path)
+
+IMAGE_BACKENDS = {'pillow': PillowBackend(), 'vips': VipsBackend()}
+if IMAGE_BACKEND not in IMAGE_BACKENDS or (IMAGE_BACKEND == 'vips' and pyvips is None):
+    print(f"Image backend '{IMAGE_BACKEND}' is not available, using pillow")
+    IMAGE_BACKEND = 'pillow'
+
+def image_backend():
+    return IMAGE_BACKENDS[IMAGE_BACKEND]
+
+def compose_card(data, fin_number, photos, issued=None, serial=None, backend=None):
+    """Composite every layer onto the template; returns the backend's card image"""
+    mark_stage("compose_text")
+    if issued is None:
+        issued = datetime.now()
+    if serial is None:
+        serial = random.randint(10000000, 99999999)
+    return (backend or image_backend()).compose(card_layers(data, fin_number, photos, issued, serial))
+
+def render_card_image(data, image_paths, fin_number, draft=False):
+    """Compose the card and return it as an RGBA Pillow image
+
+    draft=True is for previews: photos are decoded small and resized with
+    NEAREST, text and layout are unchanged.
+    """
+    backend = image_backend()
+    mark_stage("compose_photos")
+    card = compose_card(data, fin_number, backend.process_photos(image_paths, draft), backend=backend)
+    return backend.to_pil(card)
+
+def generate_card(data, image_paths, fin_number, out_path=None, user_id=None):
+    """Render and save the full card; with user_id a render record is kept for later edits"""
+    backend = image_backend()
+    mark_stage("compose_photos")
+    photos = backend.process_photos(image_paths)
+    issued = datetime.now()
+    serial = random.randint(10000000, 99999999)
+    card = compose_card(data, fin_number, photos, issued, serial, backend)
+    mark_stage("encode")
+    if out_path is None:
+        out_path = os.path.join(CARD_FOLDER, f"id_{uuid.uuid4().hex[:6]}.png")
+    backend.save_card(card, out_path)
+    del card
+    if user_id is not None:
+        save_render_record(user_id, out_path, data, fin_number, photos, issued, serial, backend)
+    return out_path
+
+# Render records - the extraction, processed photos, issue date and serial
+# behind a card, kept in RENDER_FOLDER so an edit repaints only the layers
+# that changed instead of re-parsing the PDF. Cleared with the cards.
+EDITABLE_FIELDS = list(PDF_FIELDS) + ["fan"]
+
+def _render_record_path(card_name):
+    return os.path.join(RENDER_FOLDER, f"{os.path.splitext(card_name)[0]}.json")
+
+def save_render_record(user_id, card_path, data, fin_number, photos, issued, serial, backend=None):
+    card_name = os.path.basename(card_path)
+    stem = os.path.splitext(card_name)[0]
+    photo_files = {}
+    for name, img in photos.items():
+        photo_files[name] = f"{stem}_{name}.png"
+        # PNG keeps re-renders pixel-exact
+        (backend or image_backend()).save_layer(img, os.path.join(RENDER_FOLDER, photo_files[name]))
+    with open(_render_record_path(card_name), "w") as f:
+        json.dump({'user_id': user_id, 'card': card_name, 'data': data, 'fin_number': fin_number,
+                   'issued': issued.strftime("%Y-%m-%d"), 'serial': serial, 'photos': photo_files}, f)
+
+def load_render_record(card_name, user_id):
+    """Return the card's render record for this user, or None if it expired or is not theirs"""
+    if os.path.basename(card_name) != card_name or not card_name.endswith(".png"):
+        return None
     try:
-        fin_font = ImageFont.truetype(FONT_PATH, 25)
-    except:
-        fin_font = ImageFont.load_default()
+        with open(_render_record_path(card_name)) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if record['user_id'] != user_id:
+        return None
+    if any(not os.path.exists(os.path.join(RENDER_FOLDER, name)) for name in record['photos'].values()):
+        return None
+    return record
+
+def _boxes_overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def rerender_card(record, data, fin_number, new_photos=None):
+    """Apply edits to a card on disk, repainting only the layers that changed
+
+    Each changed layer's old and new boxes are restored from the template
+    and every layer overlapping them is redrawn in paint order, which gives
+    the same pixels as a full render. Returns the names of the changed layers.
+    """
+    new_photos = new_photos or {}
+    card_path = os.path.join(CARD_FOLDER, record['card'])
+    issued = datetime.strptime(record['issued'], "%Y-%m-%d")
+    photos = {name: Image.open(os.path.join(RENDER_FOLDER, filename)).convert("RGBA")
+              for name, filename in record['photos'].items()}
+    old_layers = card_layers(record['data'], record['fin_number'], photos, issued, record['serial'])
+    photos.update(new_photos)
+    new_layers = card_layers(data, fin_number, photos, issued, record['serial'])
     
-    draw.text((1265, 545), fin_number, fill="black", font=fin_font)
+    changed = [name for name in EDITABLE_FIELDS if data[name] != record['data'][name]]
+    if fin_number != record['fin_number']:
+        changed.append('fin')
+    changed += list(new_photos)
+    
+    mark_stage("compose_text")
+    template = Image.open(TEMPLATE_PATH).convert("RGBA")
+    if os.path.exists(card_path):
+        card = Image.open(card_path).convert("RGB")
+        old_boxes = {layer[0]: layer[1] for layer in old_layers}
+        new_boxes = {layer[0]: layer[1] for layer in new_layers}
+        for name in changed:
+            boxes = [box for box in (old_boxes.get(name), new_boxes.get(name)) if box]
+            if not boxes:
+                continue
+            dirty = (max(min(box[0] for box in boxes), 0), max(min(box[1] for box in boxes), 0),
+                     min(max(box[2] for box in boxes), card.width), min(max(box[3] for box in boxes), card.height))
+            patch = template.crop(dirty)
+            for layer in new_layers:
+                if _boxes_overlap(layer[1], dirty):
+                    paint_layer(patch, layer, dirty[:2])
+            card.paste(patch.convert("RGB"), dirty[:2])
+    else:
+        # The card file was cleaned up before its record: repaint everything from the record
+        card = template
+        for layer in new_layers:
+            paint_layer(card, layer)
+        card = card.convert("RGB")
+    
+    mark_stage("encode")
+    partial_path = os.path.join(CARD_FOLDER, f".partial_{record['card']}")
+    card.save(partial_path, "PNG")
+    os.replace(partial_path, card_path)
+    
+    for name, img in new_photos.items():
+        record['photos'][name] = f"{os.path.splitext(record['card'])[0]}_{name}.png"
+        img.save(os.path.join(RENDER_FOLDER, record['photos'][name]))
+    record['data'], record['fin_number'] = data, fin_number
+    with open(_render_record_path(record['card']), "w") as f:
+        json.dump(record, f)
+    return changed
+
+# Draft previews - a quarter-resolution JPEG shown inline; the extraction
+# is kept on disk so confirming renders the full card without the PDF.
+PREVIEW_SCALE = 4
+
+def render_preview(data, image_paths, fin_number):
+    """Return a quarter-resolution draft of the card as a base64 JPEG"""
+    card = render_card_image(data, image_paths, fin_number, draft=True)
+    mark_stage("encode")
+    small = card.reduce(PREVIEW_SCALE).convert("RGB")
+    del card
+    buf = BytesIO()
+    small.save(buf, "JPEG", quality=70)
+    return base64.b64encode(buf.getvalue()).decode()
 
-    # Other text
+def save_preview(user_id, data, image_paths, fin_number):
+    """Keep what the confirm step needs; removed with the uploads by clear_old_files"""
+    token = uuid.uuid4().hex
+    with open(os.path.join(UPLOAD_FOLDER, f"preview_{token}.json"), "w") as f:
+        json.dump({'user_id': user_id, 'data': data, 'image_paths': image_paths, 'fin_number': fin_number}, f)
+    return token
+
+def load_preview(token, user_id):
+    """Return the stored preview for this user, or None if it expired or is not theirs"""
+    if not re.fullmatch(r"[0-9a-f]{32}", token or ""):
+        return None
     try:
-        font = ImageFont.truetype(FONT_PATH, 37)
-        small_multiline = ImageFont.truetype(FONT_PATH, 28)
-        small = ImageFont.truetype(FONT_PATH, 32)
-        iss_font = ImageFont.truetype(FONT_PATH, 25)
-        sn_font = ImageFont.truetype(FONT_PATH, 26) 
-    except:
-        font = small = iss_font = sn_font = ImageFont.load_default()
-
-    draw.text((405, 170), data["fullname"], fill="black", font=font, spacing=8)
-    draw.text((405, 305), data["dob"], fill="black", font=small)
-    draw.text((405, 375), data["sex"], fill="black", font=small)
-    draw.text((1130, 165), data["nationality"], fill="black", font=small)
-    draw.text((1130, 235), data["region"], fill="black", font=small_multiline, spacing=5)
-    draw.text((1130, 315), data["zone"], fill="black", font=small_multiline, spacing=5)
-    draw.text((1130, 390), data["woreda"], fill="black", font=small_multiline, spacing=5)
-    draw.text((1130, 65), data["phone"], fill="black", font=small)
-    draw.text((470, 500), data["fan"], fill="black", font=small)
-    draw.text((405, 440), expiry_full, fill="black", font=small)
-    draw.text((1930, 595), f" {random.randint(10000000, 99999999)}", fill="black", font=sn_font)
-
-    def draw_rotated_text(canvas, text, position, angle, font, color):
-        text_bbox = font.getbbox(text)
-        txt_img = Image.new("RGBA", (text_bbox[2], text_bbox[3] + 10), (255, 255, 255, 0))
-        d = ImageDraw.Draw(txt_img)
-        d.text((0, 0), text, fill=color, font=font)
-        rotated = txt_img.rotate(angle, expand=True)
-        canvas.paste(rotated, position, rotated)
-
-    draw_rotated_text(card, gc_issued, (13, 120), 90, iss_font, "black")
-    draw_rotated_text(card, ec_issued, (13, 390), 90, iss_font, "black")
-
-    out_path = os.path.join(CARD_FOLDER, f"id_{uuid.uuid4().hex[:6]}.png")
-    card.convert("RGB").save(out_path)
-    return out_path
+        with open(os.path.join(UPLOAD_FOLDER, f"preview_{token}.json")) as f:
+            preview = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if preview['user_id'] != user_id:
+        return None
+    if any(path is not None and not os.path.exists(path) for path in preview['image_paths']):
+        return None
+    return preview
+
+# Streaming ZIP export - stored (uncompressed) entries written on the fly.
+# The layout is deterministic, so the total size is known up front and a
+# Range request can resume an interrupted download.
+ZIP_CHUNK_SIZE = 64 * 1024
+ZIP_MAX_SIZE = 0xFFFFFFFF  # no ZIP64; card files only live for an hour, so exports stay far below this
+
+def _zip_dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+def user_card_files(user_id):
+    """(name, open file, size, mtime) of the user's cards still present on disk, oldest first
+
+    Only cards generated within FILE_MAX_AGE are looked at, older files have
+    been cleared. Each file is opened here and read through that handle, so
+    a card deleted by clear_old_files or replaced by an edit mid-download is
+    still streamed as it was sized. Close them with close_card_files().
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute('''SELECT card_path FROM cards_generated
+                               WHERE user_id = ? AND created_at >= ? ORDER BY created_at, id''',
+                            (user_id, _sqlite_cutoff(seconds=FILE_MAX_AGE))).fetchall()
+    finally:
+        conn.close()
+    files, seen = [], set()
+    for (card_path,) in rows:
+        name = os.path.basename(card_path)
+        if name in seen:
+            continue
+        try:
+            f = open(os.path.join(CARD_FOLDER, name), "rb")
+        except OSError:
+            continue
+        seen.add(name)
+        st = os.fstat(f.fileno())
+        files.append((name, f, st.st_size, int(st.st_mtime)))
+    return files
+
+def close_card_files(files):
+    for _, f, _, _ in files:
+        f.close()
+
+def zip_export_size(files):
+    # local header + name + data + data descriptor, central entry + name, end record
+    return sum(30 + len(name) + size + 16 + 46 + len(name) for name, _, size, _ in files) + 22
+
+def zip_export_etag(files):
+    return hashlib.sha1("|".join(f"{name}:{size}:{mtime}" for name, _, size, mtime in files).encode()).hexdigest()
+
+def _zip_stream(files):
+    """Yield the whole archive in chunks of at most ZIP_CHUNK_SIZE"""
+    offset = 0
+    central = []
+    for name, f, size, mtime in files:
+        dos_time, dos_date = _zip_dos_datetime(mtime)
+        encoded = name.encode()
+        # flag 0x08: CRC and sizes follow the data in a descriptor
+        header = struct.pack("<IHHHHHIIIHH", 0x04034b50, 20, 0x08, 0, dos_time, dos_date,
+                             0, 0, 0, len(encoded), 0) + encoded
+        yield header
+        crc = 0
+        f.seek(0)
+        while True:
+            chunk = f.read(ZIP_CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        yield struct.pack("<IIII", 0x08074b50, crc, size, size)
+        central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, 20, 20, 0x08, 0, dos_time, dos_date,
+                                   crc, size, size, len(encoded), 0, 0, 0, 0, 0, offset) + encoded)
+        offset += len(header) + size + 16
+    directory = b"".join(central)
+    yield directory
+    yield struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, len(files), len(files), len(directory), offset, 0)
+
+def stream_zip_export(files, start=0, stop=None):
+    """Yield bytes [start, stop) of the archive; earlier entries are re-read for their CRCs but not sent"""
+    position = 0
+    for chunk in _zip_stream(files):
+        chunk_end = position + len(chunk)
+        if chunk_end > start and (stop is None or position < stop):
+            yield chunk[max(start - position, 0):(stop - position) if stop is not None else None]
+        position = chunk_end
+        if stop is not None and position >= stop:
+            return
+
+# Card history - keyset pagination on (created_at, id) so a page costs the
+# same for a user's first card as for their ten-thousandth. The cursor is
+# the last row of the previous page.
+CARD_HISTORY_PAGE_SIZE = 20
+CARD_HISTORY_MAX_PAGE_SIZE = 100
+
+def encode_history_cursor(created_at, card_id):
+    return base64.urlsafe_b64encode(f"{created_at}|{card_id}".encode()).decode()
+
+def decode_history_cursor(cursor):
+    """Return (created_at, id) from a cursor, or raise ValueError"""
+    created_at, _, card_id = base64.urlsafe_b64decode(cursor.encode()).decode().rpartition("|")
+    if not created_at:
+        raise ValueError("malformed cursor")
+    return created_at, int(card_id)
+
+def card_folder_listing():
+    """Names of the files in CARD_FOLDER, listed at most once per request"""
+    if 'card_folder_listing' not in g:
+        with os.scandir(CARD_FOLDER) as entries:
+            g.card_folder_listing = frozenset(entry.name for entry in entries)
+    return g.card_folder_listing
+
+def card_history_page(user_id, cursor=None, limit=CARD_HISTORY_PAGE_SIZE):
+    """One page of the user's cards, newest first
+
+    Returns (rows, next_cursor); next_cursor is None on the last page. Each
+    row says whether the card file is still on disk, from one directory scan.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if cursor is None:
+            rows = conn.execute('''SELECT id, card_path, created_at FROM cards_generated
+                                   WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?''',
+                                (user_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute('''SELECT id, card_path, created_at FROM cards_generated
+                                   WHERE user_id = ? AND (created_at, id) < (?, ?)
+                                   ORDER BY created_at DESC, id DESC LIMIT ?''',
+                                (user_id, *cursor, limit + 1)).fetchall()
+    finally:
+        conn.close()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1][2], rows[-1][0])
+    
+    present = card_folder_listing() & {os.path.basename(row[1]) for row in rows} if rows else set()
+    cards = []
+    for card_id, card_path, created_at in rows:
+        filename = os.path.basename(card_path)
+        cards.append({'id': card_id, 'filename': filename, 'created_at': created_at,
+                      'exists': filename in present})
+    return cards, next_cursor
 
 # 6. ROUTES - FREE VERSION
 @app.route('/')
@@ -535,13 +1929,13 @@ def dashboard():
     c.execute("SELECT username, email, phone, free_cards_generated FROM users WHERE id = ?", (session['user_id'],))
     user = c.fetchone()
     
-    # Get cards generated count
-    c.execute("SELECT COUNT(*) FROM cards_generated WHERE user_id = ?", (session['user_id'],))
-    total_cards = c.fetchone()[0]
+    # Cards generated count (old cards_generated rows are purged by retention,
+    # the users counter is the lifetime total)
+    total_cards = user[3]
     
     # Get recent card generations
     c.execute('''SELECT card_path, created_at FROM cards_generated 
-                 WHERE user_id = ? ORDER BY created_at DESC LIMIT 5''',
+                 WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 5''',
               (session['user_id'],))
     recent_cards = c.fetchall()
     
@@ -556,7 +1950,8 @@ def dashboard():
                 <tr>
                     <td>{filename}</td>
                     <td>{card[1]}</td>
-                    <td><a href="/download-card/{filename}" target="_blank">Download</a></td>
+                    <td><a href="/download-card/{filename}" target="_blank">Download</a> |
+                        <a href="/cards/{filename}/edit">Edit</a></td>
                 </tr>
             '''
     else:
@@ -596,6 +1991,7 @@ def dashboard():
             <h2>Welcome, {{ username }}!</h2>
             <div>
                 <a href="/generate" class="btn btn-success">Generate New ID Card</a>
+                {% if is_admin %}<a href="/admin/usage" class="btn btn-primary">Usage Report</a>{% endif %}
                 <a href="/logout" class="btn btn-warning">Logout</a>
             </div>
         </div>
@@ -629,7 +2025,7 @@ def dashboard():
         </div>
         
         <div class="recent-cards">
-            <h3>Recent Cards Generated</h3>
+            <h3>Recent Cards Generated <a href="/cards" class="btn btn-primary" style="float: right; font-size: 14px; padding: 8px 16px;">View All</a> <a href="/export-cards.zip" class="btn btn-primary" style="float: right; font-size: 14px; padding: 8px 16px;">Download All (ZIP)</a></h3>
             {% if total_cards > 0 %}
             <table>
                 <tr>
@@ -661,7 +2057,7 @@ def dashboard():
     </body>
     </html>
     ''', username=user[0], email=user[1], phone=user[2], 
-       total_cards=total_cards, recent_cards_html=recent_cards_html)
+       total_cards=total_cards, recent_cards_html=recent_cards_html, is_admin=is_admin())
 
 @app.route('/generate', methods=['GET', 'POST'])
 @login_required
@@ -700,39 +2096,55 @@ def generate():
             </div>
             ''', 400
         
+        pdf_key = upload_digest(pdf)
         pdf_path = os.path.join(UPLOAD_FOLDER, f"temp_{uuid.uuid4().hex[:5]}.pdf")
         pdf.save(pdf_path)
         
         try:
-            extracted_images = extract_all_images(pdf_path)
-            data = extract_pdf_data(pdf_path, extracted_images)
-            user_photo_path = save_user_uploaded_image(user_photo)
-            
-            if not user_photo_path:
-                return "Suura Ashaaraa Crop Ta'e Qofa save godhuu keessatti dogoggora ta'e", 400
-            
-            final_image_paths = prepare_images_for_card(extracted_images, user_photo_path)
-            card_path = generate_card(data, final_image_paths, fin_number)
-            
-            # Record the card generation
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("INSERT INTO cards_generated (user_id, card_path) VALUES (?, ?)",
-                     (session['user_id'], card_path))
-            
-            # Update free cards count
-            c.execute("UPDATE users SET free_cards_generated = free_cards_generated + 1 WHERE id = ?",
-                     (session['user_id'],))
-            
-            # Record in free transactions
-            c.execute("INSERT INTO free_transactions (user_id) VALUES (?)",
-                     (session['user_id'],))
+            with render_deadline(), measure_render_memory() as memory, request_profile("generate") as profile:
+                mark_stage("extract_images")
+                # The FIN typed into the form is what goes on the card, so no OCR fallback
+                extracted_images, data = extract_pdf_cached(pdf_path, pdf_key, ocr=False)
+                mark_stage("save_photo")
+                user_photo_path = save_user_uploaded_image(user_photo)
+                
+                if not user_photo_path:
+                    return "Suura Ashaaraa Crop Ta'e Qofa save godhuu keessatti dogoggora ta'e", 400
+                
+                final_image_paths = prepare_images_for_card(extracted_images, user_photo_path)
+                if request.form.get("action") == "preview":
+                    preview_b64 = render_preview(data, final_image_paths, fin_number)
+                else:
+                    card_path = generate_card(data, final_image_paths, fin_number, user_id=session['user_id'])
             
-            conn.commit()
-            conn.close()
+            if request.form.get("action") == "preview":
+                token = save_preview(session['user_id'], data, final_image_paths, fin_number)
+                return render_preview_page(preview_b64, token, data)
             
-            return send_file(card_path, mimetype='image/png', as_attachment=True, download_name="Fayda_Card.png")
+            return send_card_response(card_path, memory, profile)
             
+        except RenderDeadlineExceeded as e:
+            return f'''
+            <div style="text-align: center; margin-top: 50px; font-family: sans-serif;">
+                <h2 style="color: #e74c3c;">Error!</h2>
+                <div style="color: #c0392b; background-color: #fadbd8; padding: 20px; border-radius: 10px; display: inline-block;">
+                    Processing this PDF took too long and was stopped. ({e})
+                </div>
+                <br><br>
+                <a href="/generate" style="padding: 10px 20px; background: #3498db; color: white; text-decoration: none; border-radius: 5px;">Try Again</a>
+            </div>
+            ''', 503
+        except PhotoTooLarge as e:
+            return f'''
+            <div style="text-align: center; margin-top: 50px; font-family: sans-serif;">
+                <h2 style="color: #e74c3c;">Error!</h2>
+                <div style="color: #c0392b; background-color: #fadbd8; padding: 20px; border-radius: 10px; display: inline-block;">
+                    A photo in this PDF is too large to process, please use a smaller one. ({e})
+                </div>
+                <br><br>
+                <a href="/generate" style="padding: 10px 20px; background: #3498db; color: white; text-decoration: none; border-radius: 5px;">Try Again</a>
+            </div>
+            ''', 413
         except Exception as e:
             return f"Error: {str(e)}", 500
     
@@ -763,6 +2175,14 @@ def generate():
             <h1 style="color: #27ae60;">🎉 Generate FREE ID Card</h1>
             <p style="font-size: 18px; color: #666;">No payment required - Completely FREE service!</p>
         </div>
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                {% for category, message in messages %}
+                    <div class="{{ category }}" style="color: red; background: #ffebee; padding: 10px; border-radius: 5px; margin-bottom: 20px;">{{ message }}</div>
+                {% endfor %}
+            {% endif %}
+        {% endwith %}
+        
         
         <div class="step-guide">
             <h3>📋 Step-by-Step Guide:</h3>
@@ -809,9 +2229,12 @@ def generate():
                     </div>
                 </div>
                 
-                <button type="submit">
+                <button type="submit" name="action" value="generate">
                     🚀 Generate FREE ID Card
                 </button>
+                <button type="submit" name="action" value="preview" style="margin-top: 10px; background: #3498db;">
+                    👁 Preview Draft First
+                </button>
             </form>
         </div>
         
@@ -861,6 +2284,73 @@ def generate():
     </html>
     ''')
 
+def send_card_response(card_path, memory, profile=None):
+    """Record a finished card and send it to the browser"""
+    # Record the card generation (cards_generated, users counter and
+    # free_transactions are written together by the accounting writer)
+    record_card_generation(session['user_id'], card_path)
+    
+    response = send_file(card_path, mimetype='image/png', as_attachment=True, download_name="Fayda_Card.png")
+    response.headers['X-Render-Peak-RSS-KB'] = str(memory['peak_rss_kb'])
+    if 'tracemalloc_peak_kb' in memory:
+        response.headers['X-Render-Tracemalloc-Peak-KB'] = str(memory['tracemalloc_peak_kb'])
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile['id']
+    return response
+
+def render_preview_page(preview_b64, token, data):
+    return render_template_string('''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Preview - FREE ID Card</title>
+        <style>
+            body { font-family: Arial; max-width: 800px; margin: 0 auto; padding: 20px; background: #f0f7ff; }
+            .form-container { background: white; padding: 30px; border-radius: 15px; box-shadow: 0 4px 20px rgba(0,0,0,0.1); text-align: center; }
+            img { width: 100%; border: 1px solid #ddd; border-radius: 8px; }
+            button { background: linear-gradient(135deg, #27ae60 0%, #2ecc71 100%); color: white; padding: 15px 40px; border: none; border-radius: 8px; cursor: pointer; width: 100%; font-size: 18px; font-weight: bold; }
+            .note { background: #fff3cd; padding: 15px; border-radius: 10px; margin: 20px 0; }
+        </style>
+    </head>
+    <body>
+        <div style="text-align: center; margin-bottom: 30px;">
+            <h1 style="color: #27ae60;">👁 Draft Preview</h1>
+            <p style="color: #666;">Low resolution draft - check the photo and details before downloading.</p>
+        </div>
+        <div class="form-container">
+            <img src="data:image/jpeg;base64,{{ preview_b64 }}" alt="Card preview">
+            <div class="note">Maqaa: <strong>{{ data.fullname }}</strong></div>
+            <form method="POST" action="/generate/confirm">
+                <input type="hidden" name="token" value="{{ token }}">
+                <button type="submit">✅ Confirm &amp; Download Full Card</button>
+            </form>
+            <p><a href="/generate" style="color: #3498db; text-decoration: none;">← Wrong file? Start over</a></p>
+        </div>
+    </body>
+    </html>
+    ''', preview_b64=preview_b64, token=token, data=data)
+
+@app.route('/generate/confirm', methods=['POST'])
+@login_required
+def generate_confirm():
+    """Turn a previewed extraction into the full-resolution card without re-parsing the PDF"""
+    preview = load_preview(request.form.get("token"), session['user_id'])
+    if preview is None:
+        flash('Preview expired, please upload your files again.', 'error')
+        return redirect(url_for('generate'))
+    
+    try:
+        with render_deadline(), measure_render_memory() as memory, request_profile("confirm") as profile:
+            card_path = generate_card(preview['data'], preview['image_paths'], preview['fin_number'],
+                                      user_id=session['user_id'])
+        return send_card_response(card_path, memory, profile)
+    except RenderDeadlineExceeded as e:
+        return f"Error: {str(e)}", 503
+    except PhotoTooLarge as e:
+        return f"Error: photo too large to process ({e})", 413
+    except Exception as e:
+        return f"Error: {str(e)}", 500
+
 @app.route('/download-card/<filename>')
 @login_required
 def download_card(filename):
@@ -872,6 +2362,225 @@ def download_card(filename):
         flash('Card not found!', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/cards/<filename>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_card(filename):
+    """Correct a field, the FIN or the photo of a card without uploading the PDF again"""
+    record = load_render_record(filename, session['user_id'])
+    if record is None:
+        flash('This card can no longer be edited, please generate it again.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if request.method == 'POST':
+        fin_number = request.form.get("fin_number", "")
+        if not fin_number.isdigit() or len(fin_number) != 12:
+            flash("FIN Lakkoofsaan dijiitii 12 qofa ta'uu qaba!", 'error')
+            return redirect(url_for('edit_card', filename=filename))
+        
+        data = dict(record['data'])
+        for field in EDITABLE_FIELDS:
+            if field in request.form:
+                data[field] = request.form[field].replace("\r\n", "\n").strip()
+        
+        try:
+            with render_deadline(), measure_render_memory() as memory, request_profile("edit") as profile:
+                new_photos = {}
+                user_photo = request.files.get("photo")
+                if user_photo and user_photo.filename != '':
+                    mark_stage("save_photo")
+                    user_photo_path = save_user_uploaded_image(user_photo)
+                    if not user_photo_path:
+                        return "Suura Ashaaraa Crop Ta'e Qofa save godhuu keessatti dogoggora ta'e", 400
+                    mark_stage("compose_photos")
+                    new_photos = process_card_photos([None, user_photo_path])
+                changed = rerender_card(record, data, fin_number, new_photos)
+            
+            response = send_file(os.path.join(CARD_FOLDER, filename), mimetype='image/png',
+                                 as_attachment=True, download_name="Fayda_Card.png")
+            response.headers['X-Render-Peak-RSS-KB'] = str(memory['peak_rss_kb'])
+            response.headers['X-Rerendered-Layers'] = ",".join(changed)
+            if profile is not None:
+                response.headers['X-Profile-Id'] = profile['id']
+            return response
+        except RenderDeadlineExceeded as e:
+            return f"Error: {str(e)}", 503
+        except PhotoTooLarge as e:
+            return f"Error: photo too large to process ({e})", 413
+        except Exception as e:
+            return f"Error: {str(e)}", 500
+    
+    return render_template_string('''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Edit Card - FREE ID Card</title>
+        <style>
+            body { font-family: Arial; max-width: 800px; margin: 0 auto; padding: 20px; background: #f0f7ff; }
+            .form-container { background: white; padding: 30px; border-radius: 15px; box-shadow: 0 4px 20px rgba(0,0,0,0.1); }
+            .form-group { margin-bottom: 15px; }
+            label { display: block; margin-bottom: 5px; font-weight: bold; }
+            input, textarea { width: 100%; padding: 10px; box-sizing: border-box; border: 2px solid #ddd; border-radius: 8px; font-size: 15px; }
+            button { background: linear-gradient(135deg, #27ae60 0%, #2ecc71 100%); color: white; padding: 15px 40px; border: none; border-radius: 8px; cursor: pointer; width: 100%; font-size: 18px; font-weight: bold; }
+        </style>
+    </head>
+    <body>
+        <div style="text-align: center; margin-bottom: 30px;">
+            <h1 style="color: #27ae60;">✏️ Edit Card</h1>
+            <p style="color: #666;">{{ filename }} - only the parts you change are redrawn, no PDF needed.</p>
+        </div>
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                {% for category, message in messages %}
+                    <div class="{{ category }}" style="color: red; background: #ffebee; padding: 10px; border-radius: 5px; margin-bottom: 20px;">{{ message }}</div>
+                {% endfor %}
+            {% endif %}
+        {% endwith %}
+        <div class="form-container">
+            <form method="POST" enctype="multipart/form-data">
+                <div class="form-group">
+                    <label for="fin_number">FIN Lakkoofsaa</label>
+                    <input type="text" name="fin_number" id="fin_number" value="{{ fin_number }}" pattern="\\d{12}" maxlength="12" required>
+                </div>
+                {% for field, multiline in fields %}
+                <div class="form-group">
+                    <label for="{{ field }}">{{ field }}</label>
+                    {% if multiline %}
+                    <textarea name="{{ field }}" id="{{ field }}" rows="2">{{ data[field] }}</textarea>
+                    {% else %}
+                    <input type="text" name="{{ field }}" id="{{ field }}" value="{{ data[field] }}">
+                    {% endif %}
+                </div>
+                {% endfor %}
+                <div class="form-group">
+                    <label for="photo">Suura Ashaaraa Haaraa (optional)</label>
+                    <input type="file" name="photo" id="photo" accept="image/*">
+                </div>
+                <button type="submit">💾 Save &amp; Download</button>
+            </form>
+            <p style="text-align: center;"><a href="/dashboard" style="color: #3498db; text-decoration: none;">← Back to Dashboard</a></p>
+        </div>
+    </body>
+    </html>
+    ''', filename=filename, fin_number=record['fin_number'], data=record['data'],
+       fields=[(field, PDF_FIELDS[field][1] if field in PDF_FIELDS else False) for field in EDITABLE_FIELDS])
+
+def card_history_args():
+    """(cursor, limit) from the query string, or None when they are invalid"""
+    try:
+        limit = min(max(int(request.args.get('limit', CARD_HISTORY_PAGE_SIZE)), 1), CARD_HISTORY_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        return (decode_history_cursor(cursor) if cursor else None), limit
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+@app.route('/api/cards')
+@login_required
+def api_card_history():
+    """The user's cards, newest first; pass next_cursor back as ?cursor= for the next page"""
+    args = card_history_args()
+    if args is None:
+        return {'error': 'invalid cursor or limit'}, 400
+    cards, next_cursor = card_history_page(session['user_id'], *args)
+    for card in cards:
+        card['download_url'] = url_for('download_card', filename=card['filename']) if card['exists'] else None
+    return {'cards': cards, 'next_cursor': next_cursor}
+
+@app.route('/cards')
+@login_required
+def card_history():
+    args = card_history_args()
+    if args is None:
+        return redirect(url_for('card_history'))
+    cards, next_cursor = card_history_page(session['user_id'], *args)
+    return render_template_string('''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Card History - FREE ID Card Service</title>
+        <style>
+            body { font-family: Arial; max-width: 1200px; margin: 0 auto; padding: 20px; background: #f9f9f9; }
+            .recent-cards { background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); margin-top: 20px; }
+            .btn { padding: 12px 24px; color: white; text-decoration: none; border-radius: 5px; display: inline-block; margin: 5px; background: #3498db; }
+            table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+            th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+            th { background: #f8f9fa; }
+            .expired { color: #999; }
+        </style>
+    </head>
+    <body>
+        <h2>📜 Card History</h2>
+        <div class="recent-cards">
+            <table>
+                <tr>
+                    <th>File Name</th>
+                    <th>Generated Date</th>
+                    <th>Action</th>
+                </tr>
+                {% for card in cards %}
+                <tr>
+                    <td>{{ card.filename }}</td>
+                    <td>{{ card.created_at }}</td>
+                    {% if card.exists %}
+                    <td><a href="/download-card/{{ card.filename }}" target="_blank">Download</a> |
+                        <a href="/cards/{{ card.filename }}/edit">Edit</a></td>
+                    {% else %}
+                    <td class="expired">File removed</td>
+                    {% endif %}
+                </tr>
+                {% else %}
+                <tr><td colspan="3">No cards generated yet</td></tr>
+                {% endfor %}
+            </table>
+            <div style="text-align: right; margin-top: 15px;">
+                {% if request.args.get('cursor') %}<a href="{{ url_for('card_history', limit=request.args.get('limit')) }}" class="btn">⟵ Newest</a>{% endif %}
+                {% if next_cursor %}<a href="{{ url_for('card_history', cursor=next_cursor, limit=request.args.get('limit')) }}" class="btn">Older ⟶</a>{% endif %}
+            </div>
+        </div>
+        <div style="text-align: center; margin-top: 30px;">
+            <a href="/dashboard" style="color: #3498db; text-decoration: none; font-size: 16px;">← Back to Dashboard</a>
+        </div>
+    </body>
+    </html>
+    ''', cards=cards, next_cursor=next_cursor)
+
+@app.route('/export-cards.zip')
+@login_required
+def export_cards():
+    """Stream all of the user's still-present cards as one ZIP (supports Range resume)"""
+    files = user_card_files(session['user_id'])
+    if not files:
+        flash('No cards available to export!', 'error')
+        return redirect(url_for('dashboard'))
+    
+    total = zip_export_size(files)
+    if total > ZIP_MAX_SIZE:
+        close_card_files(files)
+        flash('Too many cards for one export, please download them individually.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    etag = zip_export_etag(files)
+    headers = {'Accept-Ranges': 'bytes', 'ETag': f'"{etag}"',
+               'Content-Disposition': 'attachment; filename=Fayda_Cards.zip'}
+    byte_range = request.range
+    # If-Range: only resume when the card set has not changed since the first download
+    if byte_range and ('If-Range' not in request.headers or request.if_range.etag == etag):
+        span = byte_range.range_for_length(total)
+        if span is None:
+            close_card_files(files)
+            return Response(status=416, headers={'Content-Range': f'bytes */{total}'})
+        start, stop = span
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+        headers['Content-Length'] = str(stop - start)
+        response = Response(stream_zip_export(files, start, stop), status=206,
+                            mimetype='application/zip', headers=headers, direct_passthrough=True)
+    else:
+        headers['Content-Length'] = str(total)
+        response = Response(stream_zip_export(files), mimetype='application/zip',
+                            headers=headers, direct_passthrough=True)
+    # The server calls this once the download finishes or is dropped
+    response.call_on_close(lambda: close_card_files(files))
+    return response
+
 @app.route('/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':
@@ -1001,6 +2710,124 @@ def reset_password(token):
     </html>
     ''')
 
+@app.route('/admin/usage')
+@admin_required
+def admin_usage():
+    """Usage report served from the rollup tables"""
+    report = load_usage_report()
+    peak_day = max([row[1] for row in report['daily']] or [1])
+    peak_hour = max([row[1] for row in report['hourly']] or [1])
+
+    return render_template_string('''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Usage Report - FREE ID Card Service</title>
+        <style>
+            body { font-family: Arial; max-width: 1200px; margin: 0 auto; padding: 20px; background: #f9f9f9; }
+            .panel { background: white; padding: 20px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); margin-bottom: 20px; }
+            .chart { display: flex; align-items: flex-end; height: 200px; gap: 2px; border-bottom: 1px solid #ddd; }
+            .bar { flex: 1; background: #27ae60; min-height: 1px; }
+            .bar.hour { background: #3498db; }
+            table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+            th, td { padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }
+            th { background: #f8f9fa; }
+            a { color: #3498db; text-decoration: none; }
+        </style>
+    </head>
+    <body>
+        <h2>📊 Usage Report</h2>
+        <p><a href="/dashboard">← Back to Dashboard</a></p>
+
+        <div class="panel">
+            <h3>Cards per day (last {{ days }} days) <a href="/admin/usage.csv?kind=daily">CSV</a></h3>
+            <div class="chart">
+                {% for day, cards in report.daily %}
+                <div class="bar" style="height: {{ (cards * 100 / peak_day)|round(1) }}%" title="{{ day }}: {{ cards }}"></div>
+                {% endfor %}
+            </div>
+        </div>
+
+        <div class="panel">
+            <h3>Cards per hour, UTC (last {{ hours }} hours) <a href="/admin/usage.csv?kind=hourly">CSV</a></h3>
+            <div class="chart">
+                {% for hour, cards in report.hourly %}
+                <div class="bar hour" style="height: {{ (cards * 100 / peak_hour)|round(1) }}%" title="{{ hour }}: {{ cards }}"></div>
+                {% endfor %}
+            </div>
+        </div>
+
+        <div class="panel">
+            <h3>Top users (last {{ days }} days) <a href="/admin/usage.csv?kind=users">CSV</a></h3>
+            <table>
+                <tr><th>Username</th><th>Cards</th></tr>
+                {% for username, cards in report.users %}
+                <tr><td>{{ username }}</td><td>{{ cards }}</td></tr>
+                {% else %}
+                <tr><td colspan="2">No cards generated yet</td></tr>
+                {% endfor %}
+            </table>
+        </div>
+    </body>
+    </html>
+    ''', report=report, peak_day=peak_day, peak_hour=peak_hour,
+       days=USAGE_REPORT_DAYS, hours=USAGE_REPORT_HOURS)
+
+@app.route('/admin/usage.csv')
+@admin_required
+def admin_usage_csv():
+    kind = request.args.get('kind', 'daily')
+    headers = {'daily': ['day', 'cards'], 'hourly': ['hour_utc', 'cards'], 'users': ['username', 'cards']}
+    if kind not in headers:
+        return "Unknown report kind", 400
+
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(headers[kind])
+    writer.writerows(load_usage_report()[kind])
+    return Response(out.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=usage_{kind}.csv'})
+
+@app.route('/admin/memory')
+@admin_required
+def admin_memory():
+    """Recent per-render memory figures of this worker, for sizing worker counts"""
+    history = list(RENDER_MEMORY_HISTORY)
+    peaks = sorted(stats['peak_rss_kb'] for stats in history)
+    return {
+        'pid': os.getpid(),
+        'budget_mb': RENDER_MEMORY_BUDGET_MB,
+        'tracemalloc': RENDER_MEMORY_TRACE,
+        'renders': len(history),
+        'peak_rss_kb_max': peaks[-1] if peaks else None,
+        'peak_rss_kb_p50': peaks[len(peaks) // 2] if peaks else None,
+        'recent': history[-20:],
+    }
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """List captured request profiles, newest first"""
+    if not os.path.isdir(PROFILE_FOLDER):
+        return {'enabled': PROFILING_ENABLED, 'profiles': []}
+    names = sorted((f for f in os.listdir(PROFILE_FOLDER) if f.endswith('.prof')), reverse=True)
+    return {'enabled': PROFILING_ENABLED, 'profiles': [os.path.splitext(f)[0] for f in names]}
+
+@app.route('/admin/profiles/<filename>')
+@admin_required
+def admin_profile_download(filename):
+    """Download a capture (<id>.prof for pstats/snakeviz, <id>.txt for the summary)"""
+    profile_path = os.path.join(PROFILE_FOLDER, os.path.basename(filename))
+    if filename.endswith(('.prof', '.txt')) and os.path.isfile(profile_path):
+        return send_file(os.path.abspath(profile_path), as_attachment=True, download_name=os.path.basename(filename))
+    return "Profile not found", 404
+
+@app.route('/admin/cache')
+@admin_required
+def admin_cache():
+    """Hit ratios of the render caches (text: this worker, shared: this worker's lookups)"""
+    return {'pid': os.getpid(), 'text': text_cache_stats(), 'shared': shared_cache.stats()}
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -1013,6 +2840,7 @@ def cleanup_files():
     # Run cleanup every 10 requests to avoid performance issues
     if random.randint(1, 10) == 1:
         clear_old_files()
+    maybe_run_retention()
 
 # Error handlers
 @app.errorhandler(404)
@@ -1057,7 +2885,96 @@ def internal_error(error):
     </html>
     '''), 500
 
-if __name__ == "__main__":
+# 7. COMMAND LINE
+def render_job(job):
+    """Render one card without Flask, sessions or SQLite (runs inside a pool worker)"""
+    started = time.time()
+    with tempfile.TemporaryDirectory(prefix="render_") as tmp:
+        extracted_images = extract_all_images(job['pdf'], out_dir=tmp)
+        data, _ = extract_pdf_data(job['pdf'], extracted_images)
+        image_paths = prepare_images_for_card(extracted_images, job.get('photo'))
+        # Written under a temporary name so an interrupted run never leaves a half-written card
+        partial_path = os.path.join(os.path.dirname(job['out']), f".partial_{os.path.basename(job['out'])}")
+        generate_card(data, image_paths, job.get('fin') or data['fin'], out_path=partial_path)
+        os.replace(partial_path, job['out'])
+    return time.time() - started
+
+def collect_render_jobs(source, out_dir):
+    """Build jobs from a directory of PDFs (photo = same name .png/.jpg) or a CSV manifest
+
+    Manifest columns: pdf, photo (optional), fin (optional), out (optional).
+    Relative paths are resolved against the manifest's folder.
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() != '.pdf':
+                continue
+            photo = None
+            for photo_ext in ('.png', '.jpg', '.jpeg'):
+                if os.path.exists(os.path.join(source, stem + photo_ext)):
+                    photo = os.path.join(source, stem + photo_ext)
+                    break
+            jobs.append({'pdf': os.path.join(source, name), 'photo': photo, 'fin': None,
+                         'out': os.path.join(out_dir, f"{stem}.png")})
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='') as f:
+            for row in csv.DictReader(f):
+                pdf = os.path.join(base, row['pdf'])
+                photo = os.path.join(base, row['photo']) if row.get('photo') else None
+                out = row.get('out') or os.path.splitext(os.path.basename(pdf))[0] + ".png"
+                jobs.append({'pdf': pdf, 'photo': photo, 'fin': row.get('fin') or None,
+                             'out': os.path.join(out_dir, out)})
+    return jobs
+
+def render_batch(source, out_dir, workers=None):
+    """Render every job across a process pool, skipping cards already written by a previous run"""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = collect_render_jobs(source, out_dir)
+    pending = [job for job in jobs if not os.path.exists(job['out'])]
+    print(f"{len(jobs)} cards, {len(jobs) - len(pending)} already rendered, {len(pending)} to go")
+
+    failed = []
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(render_job, job): job for job in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                elapsed = future.result()
+                print(f"[{done}/{len(pending)}] {os.path.basename(job['out'])} ({elapsed:.2f}s)")
+            except Exception as e:
+                failed.append(job)
+                print(f"[{done}/{len(pending)}] {os.path.basename(job['pdf'])} FAILED: {e}")
+
+    print(f"Rendered {len(pending) - len(failed)} cards in {time.time() - started:.1f}s, {len(failed)} failed")
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app", description="FREE ID Card Service")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="run the web app (default)")
+    commands.add_parser("retention", help="run the retention policies once")
+    commands.add_parser("backfill-rollups", help="rebuild usage rollups from stored rows")
+    render_cmd = commands.add_parser("render", help="render cards headlessly across all cores")
+    render_cmd.add_argument("source", help="folder of PDFs (with same-name photos) or a CSV manifest")
+    render_cmd.add_argument("-o", "--out", default=CARD_FOLDER, help="output folder (default: %(default)s)")
+    render_cmd.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if args.command == "retention":
+        init_db()
+        run_retention(convert_vacuum=True)
+        return 0
+    if args.command == "backfill-rollups":
+        init_db()
+        backfill_usage_rollups()
+        return 0
+    if args.command == "render":
+        return 1 if render_batch(args.source, args.out, args.jobs) else 0
+
     # Clear old files on startup
     clear_old_files()
     
@@ -1066,4 +2983,8 @@ if __name__ == "__main__":
     print("✅ Access at: http://localhost:5000")
     
     port = int(os.environ.get("PORT", 5000))
-    app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(debug=False, host='0.0.0.0', port=port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Benchmark the card image backends (Pillow vs libvips).
+
+Renders full cards with generate_card on the real template and font
+through each available backend, with a phone-camera sized JPEG and a
+small PNG as the two photos, and reports wall time and peak RSS per card.
+
+    python bench_backends.py --renders 20
+    python bench_backends.py --backends vips --photo-size 4000x3000
+    VIPS_CONCURRENCY=2 python bench_backends.py
+
+Run from this folder (the app loads its template and font by relative path).
+The vips backend needs pyvips (pip install pyvips, plus libvips or
+pyvips-binary).
+"""
+import argparse, atexit, os, random, shutil, sys, tempfile, time
+
+from PIL import Image
+
+# Keep the app's database and shared cache out of this folder
+_app_state = tempfile.mkdtemp(prefix="bench_state_")
+atexit.register(shutil.rmtree, _app_state, True)
+os.environ.setdefault('DB_PATH', os.path.join(_app_state, "database.db"))
+os.environ.setdefault('SHARED_CACHE_PATH', os.path.join(_app_state, "cache.db"))
+
+import app
+from synthetic_inputs import make_photo
+
+DATA = {"fullname": "አበበ ከበደ | Abebe Kebede", "dob": "01/01/1990 | 23/04/1982",
+        "sex": "ወንድ | Male", "nationality": "ኢትዮጵያዊ | Ethiopian", "phone": "0911000000",
+        "region": "ኦሮሚያ\nOromia", "zone": "ጅማ\nJimma", "woreda": "ሰቃ ጨቆርሳ\nSeka Chekorsa",
+        "fan": "1234567890123456"}
+
+def make_inputs(folder, photo_size):
+    """A large JPEG for the original photo and a cropped PNG for the new one"""
+    big = os.path.join(folder, "photo_large.jpg")
+    img = Image.new("RGB", photo_size, (252, 252, 252))
+    img.paste((90, 60, 40), (photo_size[0] // 5, photo_size[1] // 8, photo_size[0] * 4 // 5, photo_size[1] * 7 // 8))
+    img.save(big, quality=90)
+    small = os.path.join(folder, "photo_new.png")
+    with open(small, "wb") as f:
+        f.write(make_photo())
+    return [big, small, None, None]
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def bench(backend, image_paths, folder, renders):
+    app.IMAGE_BACKEND = backend
+    app.generate_card(DATA, image_paths, "1234 5678 9012", out_path=os.path.join(folder, "warmup.png"))
+    seconds, peaks = [], []
+    for i in range(renders):
+        out_path = os.path.join(folder, f"{backend}_{i}.png")
+        with app.measure_render_memory() as memory:
+            started = time.perf_counter()
+            app.generate_card(DATA, image_paths, "1234 5678 9012", out_path=out_path)
+            seconds.append(time.perf_counter() - started)
+        peaks.append(memory['peak_rss_kb'])
+        os.remove(out_path)
+    seconds.sort()
+    return {'mean': sum(seconds) / len(seconds), 'p50': percentile(seconds, 50),
+            'p95': percentile(seconds, 95), 'peak_rss_kb': max(peaks)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--renders', type=int, default=10, help='cards per backend (default: %(default)s)')
+    parser.add_argument('--backends', default=','.join(app.IMAGE_BACKENDS),
+                        help='backends to compare (default: %(default)s)')
+    parser.add_argument('--photo-size', default='3000x4000', help='original photo WIDTHxHEIGHT (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    backends = [name for name in args.backends.split(',') if name]
+    unknown = set(backends) - set(app.IMAGE_BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    if 'vips' in backends and app.pyvips is None:
+        print("pyvips is not installed, skipping the vips backend")
+        backends.remove('vips')
+    photo_size = tuple(int(v) for v in args.photo_size.lower().split('x'))
+
+    random.seed(1)
+    print(f"{'backend':<8} {'renders':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'peak RSS MB':>12}")
+    with tempfile.TemporaryDirectory(prefix="bench_") as folder:
+        image_paths = make_inputs(folder, photo_size)
+        for backend in backends:
+            result = bench(backend, image_paths, folder, args.renders)
+            print(f"{backend:<8} {args.renders:>8} {result['mean'] * 1000:>9.0f} {result['p50'] * 1000:>9.0f} "
+                  f"{result['p95'] * 1000:>9.0f} {result['peak_rss_kb'] / 1024:>12.1f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
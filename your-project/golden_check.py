@@ -0,0 +1,264 @@
+"""Pixel-diff equivalence harness for the card renderer.
+
+Renders a fixed corpus of synthetic inputs through an unoptimized
+reference renderer (photos cleaned pixel by pixel and resized in full,
+every string drawn with ImageDraw.text, no text cache) and through each
+optimized path of the app, with the serial
+number (random.randint) and the issue date (datetime.now) pinned, and
+reports per-pixel difference statistics against configurable tolerances.
+
+    python golden_check.py check                      # optimized paths vs reference
+    python golden_check.py record --golden-dir goldens
+    python golden_check.py check --golden-dir goldens # ... and reference vs recorded goldens
+    python golden_check.py check --tolerance memory_budget=1.5:3
+    python golden_check.py check --paths vips          # needs pyvips installed
+
+Run from this folder (the app loads its template and font by relative path).
+"""
+import argparse, atexit, contextlib, datetime as dt, os, random, shutil, sys, tempfile
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageStat
+
+# Keep the app's database out of this folder and its shared cache off
+_app_state = tempfile.mkdtemp(prefix="golden_state_")
+atexit.register(shutil.rmtree, _app_state, True)
+os.environ.setdefault('DB_PATH', os.path.join(_app_state, "database.db"))
+os.environ.setdefault('SHARED_CACHE_MAX_MB', '0')
+
+import app
+from synthetic_inputs import make_pdf, make_photo
+
+FIXED_NOW = dt.datetime(2024, 3, 15, 10, 30)
+CORPUS_SEED = 20240315
+RENDER_SEED = 1234
+
+class _FixedDatetime(dt.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(*FIXED_NOW.timetuple()[:6])
+
+@contextlib.contextmanager
+def pinned(**config):
+    """Pin the date and serial number, and override app settings for one render"""
+    config.setdefault('IMAGE_BACKEND', 'pillow')
+    saved = {name: getattr(app, name) for name in config}
+    saved_datetime = app.datetime
+    app.datetime = _FixedDatetime
+    for name, value in config.items():
+        setattr(app, name, value)
+    random.seed(RENDER_SEED)
+    try:
+        yield
+    finally:
+        app.datetime = saved_datetime
+        for name, value in saved.items():
+            setattr(app, name, value)
+
+# 1. Corpus
+def build_corpus(folder):
+    """Synthetic cases: PDFs run through the real extraction, plus Ethiopic field data"""
+    random.seed(CORPUS_SEED)
+    cases = []
+
+    big_photo = os.path.join(folder, "photo_large.jpg")
+    img = Image.new("RGB", (2400, 3000), (252, 252, 252))
+    img.paste((90, 60, 40), (500, 400, 1900, 2800))
+    # A skin tone and greys either side of the 220 white cut-off, so a changed threshold shows
+    img.paste((205, 170, 140), (800, 700, 1600, 1700))
+    img.paste((214, 214, 214), (0, 2800, 1200, 3000))
+    img.paste((227, 227, 227), (1200, 2800, 2400, 3000))
+    img.save(big_photo, quality=90)
+
+    for i in range(3):
+        pdf_path = os.path.join(folder, f"case{i}.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(make_pdf())
+        photo_path = os.path.join(folder, f"case{i}.png")
+        with open(photo_path, "wb") as f:
+            f.write(make_photo())
+        extracted = app.extract_all_images(pdf_path, out_dir=folder)
+        data, _ = app.extract_pdf_data(pdf_path, extracted, ocr=False)
+        cases.append({'name': f"pdf{i}", 'data': data, 'fin': "1234 5678 9012",
+                      'image_paths': app.prepare_images_for_card(extracted, photo_path)})
+
+    ethiopic = {"fullname": "አበበ ከበደ | Abebe Kebede", "dob": "01/01/1990 | 23/04/1982",
+                "sex": "ወንድ | Male", "nationality": "ኢትዮጵያዊ | Ethiopian", "phone": "0911000000",
+                "region": "ኦሮሚያ\nOromia", "zone": "ጅማ\nJimma", "woreda": "ሰቃ ጨቆርሳ\nSeka Chekorsa",
+                "fan": "1234567890123456"}
+    cases.append({'name': "ethiopic_large_photos", 'data': ethiopic, 'fin': "9876 5432 1098",
+                  'image_paths': [big_photo, big_photo, None, None]})
+    cases.append({'name': "no_photos", 'data': dict(ethiopic, sex="ሴት | Female"), 'fin': "1111 2222 3333",
+                  'image_paths': [None, None, None, None]})
+    return cases
+
+# 2. Render paths
+def _reference_rotated(card, xy, text, font):
+    text_bbox = font.getbbox(text)
+    txt_img = Image.new("RGBA", (text_bbox[2], text_bbox[3] + 10), (255, 255, 255, 0))
+    ImageDraw.Draw(txt_img).text((0, 0), text, fill="black", font=font)
+    rotated = txt_img.rotate(90, expand=True)
+    card.paste(rotated, xy, rotated)
+
+_reference_photos = {}
+
+def _reference_photo(path):
+    """The photo as the original code cleaned it: a per-pixel loop over getdata"""
+    if path not in _reference_photos:
+        photo = Image.open(path).convert("RGBA")
+        photo.putdata([(255, 255, 255, 0) if item[0] > 220 and item[1] > 220 and item[2] > 220 else item
+                       for item in photo.getdata()])
+        _reference_photos[path] = photo
+    return _reference_photos[path]
+
+def render_reference(case):
+    """The card as drawn before the photo pipeline, text cache and layers were optimized
+
+    Photos are decoded in full, cleaned pixel by pixel and resized; every
+    string goes through ImageDraw.text. Nothing here calls app's render code.
+    """
+    with pinned():
+        card = Image.open(app.TEMPLATE_PATH).convert("RGBA")
+        image_paths = case['image_paths']
+        if image_paths[0] is not None:
+            photo = _reference_photo(image_paths[0])
+            for size, xy in (((310, 400), (65, 200)), ((100, 135), (800, 450))):
+                resized = photo.resize(size)
+                card.paste(resized, xy, resized)
+        if image_paths[1] is not None:
+            resized = _reference_photo(image_paths[1]).resize((530, 550))
+            card.paste(resized, (1550, 30), resized)
+
+        now = app.datetime.now()
+        eth = app.EthiopianDateConverter.to_ethiopian(now.year, now.month, now.day)
+        gc_expiry = now.replace(year=now.year + 8).strftime("%d/%m/%Y")
+        expiry_full = f"{gc_expiry} | {eth.day:02d}/{eth.month:02d}/{eth.year + 8}"
+
+        def font(size):
+            return ImageFont.truetype(app.FONT_PATH, size)
+        data = case['data']
+        draw = ImageDraw.Draw(card)
+        draw.text((1265, 545), case['fin'], fill="black", font=font(25))
+        draw.text((405, 170), data["fullname"], fill="black", font=font(37), spacing=8)
+        draw.text((405, 305), data["dob"], fill="black", font=font(32))
+        draw.text((405, 375), data["sex"], fill="black", font=font(32))
+        draw.text((1130, 165), data["nationality"], fill="black", font=font(32))
+        draw.text((1130, 235), data["region"], fill="black", font=font(28), spacing=5)
+        draw.text((1130, 315), data["zone"], fill="black", font=font(28), spacing=5)
+        draw.text((1130, 390), data["woreda"], fill="black", font=font(28), spacing=5)
+        draw.text((1130, 65), data["phone"], fill="black", font=font(32))
+        draw.text((470, 500), data["fan"], fill="black", font=font(32))
+        draw.text((405, 440), expiry_full, fill="black", font=font(32))
+        draw.text((1930, 595), f" {random.randint(10000000, 99999999)}", fill="black", font=font(26))
+        _reference_rotated(card, (13, 120), now.strftime("%d/%m/%Y"), font(25))
+        _reference_rotated(card, (13, 390), f"{eth.day:02d}/{eth.month:02d}/{eth.year}", font(25))
+        return card.convert("RGB")
+
+def render_app(case):
+    with pinned(RENDER_MEMORY_BUDGET_MB=0):
+        return app.render_card_image(case['data'], case['image_paths'], case['fin']).convert("RGB")
+
+def render_text_cache_warm(case):
+    render_app(case)  # fill the text bitmap cache, the second render is all hits
+    return render_app(case)
+
+def render_memory_budget(case):
+    with pinned(RENDER_MEMORY_BUDGET_MB=4):
+        return app.render_card_image(case['data'], case['image_paths'], case['fin']).convert("RGB")
+
+def render_preview(case):
+    with pinned():
+        return app.render_card_image(case['data'], case['image_paths'], case['fin'], draft=True).convert("RGB")
+
+def render_vips(case):
+    with pinned(IMAGE_BACKEND='vips'):
+        return app.render_card_image(case['data'], case['image_paths'], case['fin']).convert("RGB")
+
+# name -> (render function, compare scale, (max mean diff, max % of pixels changed))
+PATHS = {
+    'app': (render_app, 1, (0.0, 0.0)),
+    'text_cache_warm': (render_text_cache_warm, 1, (0.0, 0.0)),
+    'memory_budget': (render_memory_budget, 1, (1.0, 2.0)),
+    'preview': (render_preview, app.PREVIEW_SCALE, (4.0, 15.0)),
+}
+if app.pyvips is not None:
+    # libvips resizes with its own cubic kernel, so photo edges differ slightly
+    PATHS['vips'] = (render_vips, 1, (0.5, 1.0))
+GOLDEN_TOLERANCE = (0.0, 0.0)
+CHANGED_THRESHOLD = 16  # a pixel counts as changed when any channel differs by more than this
+
+# 3. Comparison
+def diff_stats(expected, actual, scale=1):
+    if scale > 1:
+        expected, actual = expected.reduce(scale), actual.reduce(scale)
+    if expected.size != actual.size:
+        return {'max': 255, 'mean': 255.0, 'changed_pct': 100.0}
+    r, g, b = ImageChops.difference(expected, actual).split()
+    diff = ImageChops.lighter(ImageChops.lighter(r, g), b)
+    histogram = diff.histogram()
+    pixels = expected.width * expected.height
+    return {'max': diff.getextrema()[1],
+            'mean': round(ImageStat.Stat(diff).mean[0], 3),
+            'changed_pct': round(100 * sum(histogram[CHANGED_THRESHOLD + 1:]) / pixels, 3)}
+
+def within(stats, tolerance):
+    max_mean, max_changed = tolerance
+    return stats['mean'] <= max_mean and stats['changed_pct'] <= max_changed
+
+def parse_tolerances(values):
+    tolerances = {name: tolerance for name, (_, _, tolerance) in PATHS.items()}
+    tolerances['golden'] = GOLDEN_TOLERANCE
+    for value in values or []:
+        name, _, limits = value.partition('=')
+        if name not in tolerances:
+            raise SystemExit(f"Unknown path '{name}' (known: {', '.join(sorted(tolerances))})")
+        mean, _, changed = limits.partition(':')
+        tolerances[name] = (float(mean), float(changed or 0))
+    return tolerances
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('mode', choices=['check', 'record'])
+    parser.add_argument('--golden-dir', help='folder of recorded reference PNGs')
+    parser.add_argument('--paths', default=','.join(PATHS), help='optimized paths to check (default: %(default)s)')
+    parser.add_argument('--tolerance', action='append', metavar='PATH=MEAN:CHANGED_PCT',
+                        help="override a path's tolerance, e.g. memory_budget=1.5:3 (use 'golden' for goldens)")
+    args = parser.parse_args(argv)
+    tolerances = parse_tolerances(args.tolerance)
+    unknown = set(filter(None, args.paths.split(','))) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown or unavailable paths: {', '.join(sorted(unknown))}")
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="golden_") as folder:
+        cases = build_corpus(folder)
+
+        if args.mode == 'record':
+            if not args.golden_dir:
+                parser.error("record needs --golden-dir")
+            os.makedirs(args.golden_dir, exist_ok=True)
+            for case in cases:
+                render_reference(case).save(os.path.join(args.golden_dir, f"{case['name']}.png"))
+            print(f"Recorded {len(cases)} goldens in {args.golden_dir}")
+            return 0
+
+        print(f"{'case':<24} {'path':<16} {'max':>5} {'mean':>8} {'changed%':>9}  result")
+        for case in cases:
+            reference = render_reference(case)
+            checks = []
+            if args.golden_dir:
+                golden = Image.open(os.path.join(args.golden_dir, f"{case['name']}.png")).convert("RGB")
+                checks.append(('golden', diff_stats(golden, reference)))
+            for name in filter(None, args.paths.split(',')):
+                render, scale, _ = PATHS[name]
+                checks.append((name, diff_stats(reference, render(case), scale)))
+            for name, stats in checks:
+                ok = within(stats, tolerances[name])
+                failures += not ok
+                print(f"{case['name']:<24} {name:<16} {stats['max']:>5} {stats['mean']:>8.3f} "
+                      f"{stats['changed_pct']:>9.3f}  {'ok' if ok else 'FAIL'}")
+
+    print(f"\n{failures} comparison(s) outside tolerance" if failures else "\nAll paths within tolerance")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""End-to-end load test for the FREE ID Card Service.
+
+Creates synthetic PDFs and photos, signs up and logs in test users, then
+drives a weighted mix of /login, /dashboard, /generate and /download-card
+from concurrent virtual users. Reports throughput, p50/p95/p99 latency and
+error rates per route.
+
+    python loadtest.py --users 8 --duration 60
+    python loadtest.py --server-cmd "gunicorn -w 4 --threads 2 -b 127.0.0.1:5000 app:app"
+
+With --server-cmd the app is started (from this folder) before the run
+and stopped afterwards, so worker/thread settings can be compared in one go.
+"""
+import argparse, http.cookiejar, io, os, random, re, shlex, subprocess, threading, time, uuid
+import urllib.error, urllib.parse, urllib.request
+from collections import defaultdict
+
+from synthetic_inputs import make_pdf, make_photo
+
+# Route -> weight in the request mix
+DEFAULT_MIX = {'login': 1, 'dashboard': 5, 'generate': 2, 'download': 2}
+
+# 1. Request encoding
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, mimetype) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: {mimetype}\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+# 2. Virtual users
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, route, seconds, ok):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+class VirtualUser:
+    def __init__(self, base_url, username, inputs, stats):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = 'loadtest'
+        self.inputs = inputs
+        self.stats = stats
+        self.cards = []
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, route, path, data=None, content_type=None):
+        req = urllib.request.Request(self.base_url + path, data=data)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        started = time.perf_counter()
+        ok, body, final_url = False, b'', ''
+        try:
+            with self.opener.open(req, timeout=120) as resp:
+                body = resp.read()
+                final_url = resp.geturl()
+                ok = resp.status < 400
+        except (urllib.error.URLError, OSError):
+            pass
+        if route:
+            self.stats.add(route, time.perf_counter() - started, ok)
+        return ok, body, final_url
+
+    def signup(self):
+        form = urllib.parse.urlencode({'username': self.username, 'email': f'{self.username}@loadtest.local',
+                                       'password': self.password, 'confirm_password': self.password})
+        self.request(None, '/signup', form.encode(), 'application/x-www-form-urlencoded')
+
+    def login(self):
+        form = urllib.parse.urlencode({'username': self.username, 'password': self.password})
+        ok, _, final_url = self.request('login', '/login', form.encode(), 'application/x-www-form-urlencoded')
+        return ok and '/dashboard' in final_url
+
+    def dashboard(self):
+        ok, body, _ = self.request('dashboard', '/dashboard')
+        if ok:
+            self.cards = re.findall(r'/download-card/([\w.]+)', body.decode(errors='ignore'))
+
+    def generate(self):
+        pdf, photo = random.choice(self.inputs)
+        fin = ''.join(random.choice('0123456789') for _ in range(12))
+        body, content_type = encode_multipart(
+            {'fin_number': fin},
+            {'pdf': ('input.pdf', pdf, 'application/pdf'), 'photo': ('photo.png', photo, 'image/png')})
+        self.request('generate', '/generate', body, content_type)
+
+    def download(self):
+        if not self.cards:
+            self.dashboard()
+        if self.cards:
+            self.request('download', f'/download-card/{random.choice(self.cards)}')
+
+    def run(self, deadline, mix):
+        self.signup()
+        self.login()
+        routes, weights = zip(*mix.items())
+        while time.time() < deadline:
+            getattr(self, random.choices(routes, weights)[0])()
+
+# 3. Runner
+def wait_for_server(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/login', timeout=2).read()
+            return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    return False
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def report(stats, elapsed):
+    print(f"\n{'route':<10} {'reqs':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    total = errors = 0
+    for route in sorted(stats.latencies):
+        values = sorted(stats.latencies[route])
+        total += len(values)
+        errors += stats.errors[route]
+        print(f"{route:<10} {len(values):>7} {len(values) / elapsed:>8.1f} "
+              f"{percentile(values, 50) * 1000:>9.0f} {percentile(values, 95) * 1000:>9.0f} "
+              f"{percentile(values, 99) * 1000:>9.0f} {stats.errors[route] / len(values):>7.1%}")
+    print(f"{'total':<10} {total:>7} {total / elapsed:>8.1f} {'':>29} {errors / max(total, 1):>7.1%}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='base URL of the app (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run (default: %(default)s)')
+    parser.add_argument('--inputs', type=int, default=5, help='distinct synthetic PDF/photo pairs (default: %(default)s)')
+    parser.add_argument('--mix', default=','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items()),
+                        help='route weights (default: %(default)s)')
+    parser.add_argument('--server-cmd', help='command that starts the app locally for the run')
+    args = parser.parse_args(argv)
+
+    mix = {k: int(v) for k, v in (item.split('=') for item in args.mix.split(','))}
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        parser.error(f"unknown routes in --mix: {', '.join(sorted(unknown))}")
+
+    server = None
+    if args.server_cmd:
+        server = subprocess.Popen(shlex.split(args.server_cmd), cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        if not wait_for_server(args.url):
+            print(f"App not reachable at {args.url}")
+            return 1
+
+        print(f"Preparing {args.inputs} synthetic inputs...")
+        inputs = [(make_pdf(), make_photo()) for _ in range(args.inputs)]
+        stats = Stats()
+        run_id = uuid.uuid4().hex[:6]
+        users = [VirtualUser(args.url, f'lt_{run_id}_{i}', inputs, stats) for i in range(args.users)]
+
+        print(f"Running {args.users} users for {args.duration:.0f}s against {args.url}")
+        started = time.time()
+        threads = [threading.Thread(target=user.run, args=(started + args.duration, mix), daemon=True)
+                   for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(stats, time.time() - started)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,28 @@
+"""Synthetic PDFs and photos shared by the load test, the golden check and the backend benchmark."""
+import io, random
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+def make_pdf():
+    """A one-page PDF with text at the rectangles extract_pdf_data reads, plus an embedded photo"""
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    fields = [((55, 369), "Test User | Load"), ((55, 433), "01/01/1990"), ((55, 408), "Oromia"),
+              ((55, 468), "Jimma"), ((55, 508), "Male"), ((55, 535), "Woreda 1"),
+              ((55, 572), "Ethiopian"), ((55, 615), "0911000000"),
+              ((55, 700), " ".join(f"{random.randint(1000, 9999)}" for _ in range(4))),
+              ((55, 720), " ".join(f"{random.randint(1000, 9999)}" for _ in range(3)))]
+    for point, text in fields:
+        page.insert_text(point, text, fontsize=8 if point[1] != 433 else 4)
+    page.insert_image(fitz.Rect(400, 100, 500, 230), stream=make_photo("JPEG", (250, 250, 250)))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def make_photo(fmt="PNG", background=(255, 255, 255)):
+    img = Image.new("RGB", (400, 420), background)
+    img.paste((random.randint(0, 200), random.randint(0, 200), random.randint(0, 200)), (80, 60, 320, 400))
+    buf = io.BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()